@@ -0,0 +1,89 @@
+import os
+import time
+from flask import current_app, g, jsonify, request
+import constants
+import jwt_functions
+import token_cache
+
+ON_APP_ENGINE = bool(os.environ.get('GAE_ENV'))
+# clients that keep sending bad tokens get 429s for the rest of the window
+auth_failures = token_cache.FailureThrottle(constants.AUTH_FAILURE_LIMIT,
+                                            constants.AUTH_FAILURE_WINDOW)
+
+
+# function to check for json request and authorization
+def check_auth_accept(header):
+    accept = header.get('Accept', '*/*')
+    if (accept != 'application/json') and (accept != '*/*'):
+        return jsonify({"Error": "Please make sure the accept is json."}), 406
+    # if missing/invalid JWT return 401
+    if 'Authorization' not in header:
+        return jsonify({"Error": "Missing auth credentials."}), 401
+    return None
+
+
+# mark a view that does not need a token (e.g. the 405 handlers)
+def public(view):
+    view.public = True
+    return view
+
+
+# the end user's address. app engine puts it in X-Appengine-User-Ip (and strips
+# any a client sends); remote_addr there is the front end, shared by everyone.
+# anywhere else the header could be forged, so it is ignored
+def client_address():
+    if ON_APP_ENGINE:
+        return request.headers.get('X-Appengine-User-Ip') or request.remote_addr
+    return request.remote_addr
+
+
+# runs before every view of the blueprint: cheap header checks first, then the
+# token is verified once and the payload is left on flask.g for the view.
+# OPTIONS is answered by flask itself, and cors preflights never carry a token
+def authenticate():
+    view = current_app.view_functions.get(request.endpoint)
+    if view is None or getattr(view, 'public', False):
+        return None
+    if request.method == 'OPTIONS':
+        return None
+    flag = check_auth_accept(request.headers)
+    if flag:
+        return flag
+    started = time.perf_counter()
+    client = client_address()
+    try:
+        token = jwt_functions.bearer_token(request)
+        # tokens already verified go through even if others from the same
+        # address keep failing
+        payload = jwt_functions.cached_payload(token)
+        if payload is None:
+            retry_after = auth_failures.retry_after(client)
+            if retry_after:
+                return jsonify({"Error": "Too many failed authentication attempts."}), 429, \
+                    {'Retry-After': str(retry_after)}
+            payload = jwt_functions.verify_token(token)
+    except jwt_functions.AuthError as ex:
+        if jwt_functions.is_token_error(ex):
+            auth_failures.record_failure(client)
+        return jwt_functions.handle_auth_error(ex)
+    finally:
+        g.auth_ms = (time.perf_counter() - started) * 1000
+    if not payload:
+        return jsonify({"Error": "Unauthorized."}), 401
+    g.payload = payload
+    g.owner_id = payload["sub"]
+    return None
+
+
+def add_server_timing(response):
+    auth_ms = g.get('auth_ms')
+    if auth_ms is not None:
+        response.headers.add('Server-Timing', 'auth;dur=%.2f' % auth_ms)
+    return response
+
+
+# install the auth pipeline on a blueprint
+def require_auth(bp):
+    bp.before_request(authenticate)
+    bp.after_request(add_server_timing)
+    return bp
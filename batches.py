@@ -0,0 +1,55 @@
+import logging
+from google.api_core import exceptions
+from google.cloud import datastore
+import constants
+import counters
+import transactions
+
+logger = logging.getLogger(__name__)
+
+# helpers for reading and writing many entities in as few rpcs as datastore allows
+
+
+def chunks(seq, size=constants.DATASTORE_BATCH_SIZE):
+    seq = list(seq)
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+# entities for keys, in the same order, None where there is no entity.
+# one get_multi per chunk; datastore returns what it finds in any order.
+def get_multi(client, keys, size=constants.DATASTORE_BATCH_SIZE):
+    found = {}
+    for chunk in chunks(keys, size):
+        for entity in client.get_multi(chunk):
+            found[entity.key.flat_path] = entity
+    return [found.get(key.flat_path) for key in keys]
+
+
+# store new entities of kind for owner_id, one per dict of properties. the ids
+# come from one allocate_ids call, then each chunk is written with put_multi in
+# a transaction that also adds the chunk to the owner's counter. returns the
+# entities (key set) and an error message for each, None for the stored ones: a
+# chunk that can't be committed fails its own entities and the rest go on.
+def create_multi(client, kind, owner_id, properties):
+    keys = client.allocate_ids(client.key(kind), len(properties)) if properties else []
+    entities = []
+    for key, props in zip(keys, properties):
+        entity = datastore.entity.Entity(key=key)
+        entity.update(props)
+        entities.append(entity)
+    errors = [None] * len(entities)
+    # room for the counter shard in each commit
+    size = constants.DATASTORE_BATCH_SIZE - 1
+    for start in range(0, len(entities), size):
+        chunk = entities[start:start + size]
+
+        def create():
+            client.put_multi(chunk)
+            counters.increment(client, kind, owner_id, len(chunk))
+        try:
+            transactions.run_in_transaction(client, create)
+        except exceptions.GoogleAPIError:
+            logger.exception("Unable to store %d %s", len(chunk), kind)
+            errors[start:start + len(chunk)] = ["Unable to store this one, try again."] * len(chunk)
+    return entities, errors
@@ -0,0 +1,86 @@
+# many threads attaching their own items to the same order at once, against
+# fake_datastore (optimistic transactions, a simulated round trip per rpc).
+# compares the old read/modify/write without a transaction with the
+# transactional put_items_on_order: throughput, retries, 409s and lost updates
+# (attaches that answered 204 but aren't on the order afterwards).
+#   python benchmarks/attach_contention.py [threads] [attaches_per_thread] [rpc_latency_ms]
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g
+from google.api_core import exceptions
+import fake_datastore
+
+fake_datastore.install()
+
+import constants
+import links
+import orders
+
+OWNER = "auth0|bench"
+
+
+# what PUT /orders/<oid>/items/<iid> did before: two gets, two puts, no transaction
+def old_attach(oid, iid):
+    client = orders.client
+    order = client.get(client.key(orders.ORDERS, int(oid)))
+    item = client.get(client.key(orders.ITEMS, int(iid)))
+    order['items'] = (order.get('items') or []) + [{"id": item.key.id, "self": ""}]
+    client.put(order)
+    item['orders'] = {"id": order.key.id, "self": ""}
+    client.put(item)
+    return '', 204
+
+
+def run(name, attach, threads, per_thread, latency):
+    client = fake_datastore.FakeClient()
+    orders.client = client
+    order, item_list = fake_datastore.make_order(client, OWNER, threads * per_thread, linked=False)
+    client.latency = latency
+    client.reset()
+    app = Flask(__name__)
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(mine):
+        with app.test_request_context('/', base_url='http://localhost/'):
+            g.payload = {"sub": OWNER}
+            for item in mine:
+                try:
+                    status = attach(str(order.key.id), str(item.key.id))[1]
+                except exceptions.Conflict:
+                    status = 409
+                with lock:
+                    statuses.setdefault(status, []).append(item.key.id)
+
+    workers = [threading.Thread(target=worker, args=(item_list[i::threads],)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - started
+    client.latency = 0
+    on_order = set(links.item_ids(client.get(order.key)))
+    attached = statuses.get(204, [])
+    lost = len([item_id for item_id in attached if item_id not in on_order])
+    print("%-14s %7.1f attaches/s  204=%d 409=%d  conflicts retried or given up=%d  lost updates=%d" % (
+        name, len(attached) / elapsed, len(attached), len(statuses.get(409, [])), client.conflicts, lost))
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.002
+    print("%d threads x %d attaches to one order, %.1f ms per rpc, %d attempts per transaction" % (
+        threads, per_thread, latency * 1000, constants.TXN_MAX_ATTEMPTS))
+    run("old", old_attach, threads, per_thread, latency)
+    run("transactional", orders.put_items_on_order, threads, per_thread, latency)
+
+
+if __name__ == '__main__':
+    main()
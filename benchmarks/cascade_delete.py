@@ -0,0 +1,52 @@
+# rpcs and time for DELETE /orders/<id> on an order with many items (and
+# DELETE /items/<id> for one of them) against fake_datastore, with a simulated
+# round trip per rpc. the old cascade made a lookup and a commit per item.
+#   python benchmarks/cascade_delete.py [items] [rpc_latency_ms]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g
+import fake_datastore
+
+fake_datastore.install()
+
+import items
+import links
+import orders
+
+OWNER = "auth0|bench"
+
+
+def timed(client, name, func):
+    client.reset()
+    started = time.perf_counter()
+    response, status = func()
+    assert status == 204, status
+    print("  %-14s %8.1f ms  %s" % (name, (time.perf_counter() - started) * 1000,
+                                    ", ".join("%s=%d" % kv for kv in sorted(client.rpcs.items()))))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 2.0 / 1000
+    client = fake_datastore.FakeClient()
+    orders.client = items.client = client
+    order, item_list = fake_datastore.make_order(client, OWNER, count)
+    client.latency = latency
+    app = Flask(__name__)
+    print("order with %d items, %.1f ms per rpc (the old cascade made about %d rpcs)" % (
+        count, latency * 1000, 2 * count + 5))
+    with app.test_request_context('/', base_url='http://localhost/'):
+        g.payload = {"sub": OWNER}
+        timed(client, "DELETE item", lambda: items.items_delete_specific(str(item_list[0].key.id)))
+        timed(client, "DELETE order", lambda: orders.orders_delete_specific(str(order.key.id)))
+    client.latency = 0
+    left = [item for item in client.get_multi([item.key for item in item_list[1:]]) if links.order_ids(item)]
+    assert client.get(order.key) is None and not left, left
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+# in-memory stand-in for google.cloud.datastore.Client that counts RPCs, for the
+# benchmarks only. it speaks the subset of the client api the app uses (get,
+# get_multi, put, put_multi, delete, delete_multi, allocate_ids, query,
+# transaction) with the same batching rules: writes inside a transaction are
+# sent with the commit, lookups are one rpc however many keys they name.
+# transactions are optimistic like datastore's: a commit fails with Conflict
+# when an entity the transaction read or writes was committed by someone else
+# after it was read. latency (seconds) is slept once per rpc.
+# install() swaps it in for the real client and make_order builds the order and
+# items most of the benchmarks start from.
+import copy
+import itertools
+import threading
+import time
+from google.api_core.exceptions import Conflict
+from google.cloud import datastore
+from google.cloud.datastore import Entity, Key
+
+ORDERS = "orders"
+ITEMS = "items"
+OPS = {'=': lambda a, b: a == b, '>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b,
+       '>': lambda a, b: a > b, '<': lambda a, b: a < b}
+
+
+class FakeClient(object):
+    def __init__(self, project='bench', latency=0.0):
+        self.project = project
+        self.latency = latency
+        self.rpcs = {}
+        self.conflicts = 0
+        self._store = {}
+        self._versions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def key(self, *path, **kwargs):
+        return Key(*path, project=self.project)
+
+    def _rpc(self, name):
+        with self._lock:
+            self.rpcs[name] = self.rpcs.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset(self):
+        with self._lock:
+            self.rpcs = {}
+            self.conflicts = 0
+
+    def total_rpcs(self):
+        with self._lock:
+            return sum(self.rpcs.values())
+
+    @property
+    def current_transaction(self):
+        return getattr(self._local, 'transaction', None)
+
+    def _complete(self, entity):
+        if entity.key.is_partial:
+            with self._lock:
+                entity.key = entity.key.completed_key(next(self._ids))
+
+    def _lookup(self, keys):
+        self._rpc('lookup')
+        txn = self.current_transaction
+        found = []
+        with self._lock:
+            for key in keys:
+                path = key.flat_path
+                if txn is not None:
+                    txn.read_versions.setdefault(path, self._versions.get(path, 0))
+                entity = self._store.get(path)
+                found.append((key, copy.deepcopy(entity)))
+        return found
+
+    def get(self, key, **kwargs):
+        return self._lookup([key])[0][1]
+
+    def get_multi(self, keys, missing=None, **kwargs):
+        results = []
+        for key, entity in self._lookup(keys):
+            if entity is not None:
+                results.append(entity)
+            elif missing is not None:
+                missing.append(Entity(key=key))
+        return results
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities):
+        txn = self.current_transaction
+        if txn is not None:
+            txn.puts.extend(entities)
+            return
+        self._rpc('commit')
+        self._apply(entities, [])
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys):
+        txn = self.current_transaction
+        if txn is not None:
+            txn.deletes.extend(keys)
+            return
+        self._rpc('commit')
+        self._apply([], keys)
+
+    def _apply(self, entities, keys):
+        for entity in entities:
+            self._complete(entity)
+        with self._lock:
+            for entity in entities:
+                path = entity.key.flat_path
+                self._store[path] = copy.deepcopy(entity)
+                self._versions[path] = self._versions.get(path, 0) + 1
+            for key in keys:
+                self._store.pop(key.flat_path, None)
+                self._versions[key.flat_path] = self._versions.get(key.flat_path, 0) + 1
+
+    def allocate_ids(self, incomplete_key, num_ids):
+        self._rpc('allocate_ids')
+        with self._lock:
+            return [incomplete_key.completed_key(next(self._ids)) for _ in range(num_ids)]
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def query(self, kind=None, projection=(), **kwargs):
+        return FakeQuery(self, kind, projection)
+
+
+class FakeTransaction(object):
+    def __init__(self, client):
+        self.client = client
+        self.read_versions = {}
+        self.puts = []
+        self.deletes = []
+
+    def __enter__(self):
+        self.client._rpc('begin_transaction')
+        self.client._local.transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.client._local.transaction = None
+        if exc_type is not None:
+            self.client._rpc('rollback')
+            return False
+        self.commit()
+        return False
+
+    def commit(self):
+        client = self.client
+        client._rpc('commit')
+        with client._lock:
+            written = [e.key.flat_path for e in self.puts if not e.key.is_partial]
+            written += [k.flat_path for k in self.deletes]
+            for path in set(self.read_versions) | set(written):
+                if client._versions.get(path, 0) != self.read_versions.get(path, client._versions.get(path, 0)):
+                    client.conflicts += 1
+                    raise Conflict("too much contention on these datastore entities")
+        client._apply(self.puts, self.deletes)
+
+
+class FakeQuery(object):
+    def __init__(self, client, kind, projection=()):
+        self.client = client
+        self.kind = kind
+        self.filters = []
+        self.order = []
+        self.projection = list(projection)
+
+    def add_filter(self, prop, op, value):
+        self.filters.append((prop, op, value))
+        return self
+
+    def keys_only(self):
+        self.projection = ['__key__']
+
+    def fetch(self, limit=None, offset=0, start_cursor=None, **kwargs):
+        self.client._rpc('run_query')
+        with self.client._lock:
+            rows = [copy.deepcopy(e) for path, e in sorted(self.client._store.items(), key=lambda kv: repr(kv[0]))
+                    if e.key.kind == self.kind
+                    and all(p in e and OPS[op](e[p], v) for p, op, v in self.filters)]
+        for prop in reversed(self.order):
+            rows.sort(key=lambda e: e.get(prop.lstrip('-')), reverse=prop.startswith('-'))
+        start = (int(start_cursor) if start_cursor else 0) + (offset or 0)
+        end = len(rows) if limit is None else start + limit
+        if self.projection == ['__key__']:
+            rows = [Entity(key=e.key) for e in rows]
+        return FakeIterator(rows[start:end], str(end).encode('ascii') if end < len(rows) else None)
+
+
+class FakeIterator(object):
+    def __init__(self, rows, next_page_token):
+        self.rows = rows
+        self.next_page_token = next_page_token
+        # what the real iterator keeps after a batch, the fake never cuts one short
+        self._more_results = False
+
+    @property
+    def pages(self):
+        return iter([self.rows])
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+# the blueprints make their client at import time, call this before importing them
+def install():
+    datastore.Client = FakeClient
+
+
+# an order of owner's with count items. linked puts the items on the order and
+# the order on each item, the way PUT /orders/<oid>/items/<iid> leaves them
+def make_order(client, owner, count, linked=True):
+    order = Entity(key=client.key(ORDERS))
+    order.update({"has_shipped": False, "date": "2021-06-01", "location": "Portland", "owner_id": owner})
+    client.put(order)
+    item_list = []
+    for i in range(count):
+        item = Entity(key=client.key(ITEMS))
+        item.update({"item_name": "item %d" % i, "quantity": i, "item_description": "", "owner_id": owner})
+        if linked:
+            item["orders"] = {"id": order.key.id, "self": "http://localhost/orders/%d" % order.key.id}
+        item_list.append(item)
+    client.put_multi(item_list)
+    if linked:
+        order["items"] = [{"id": item.key.id, "self": "http://localhost/items/%d" % item.key.id}
+                          for item in item_list]
+        client.put(order)
+    return order, item_list
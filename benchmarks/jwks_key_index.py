@@ -0,0 +1,58 @@
+# compares the per-request cost of the old verify path (scan the jwks and hand
+# jose a fresh key dict) with the kid -> prebuilt key index in jwks.JWKSCache.
+# everything runs locally with a generated key, no auth0 calls are made.
+#   python benchmarks/jwks_key_index.py [iterations]
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jose import jwt
+import constants
+import jwks
+import jwt_backends
+from local_keys import ISSUER, make_key, make_token
+
+
+# the verify path as it was before the key index
+def old_verify(token, key_set):
+    unverified_header = jwt.get_unverified_header(token)
+    rsa_key = {}
+    for key in key_set["keys"]:
+        if key["kid"] == unverified_header["kid"]:
+            rsa_key = {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key["use"],
+                "n": key["n"],
+                "e": key["e"]
+            }
+    return jwt.decode(token, rsa_key, algorithms=constants.ALGORITHMS,
+                      audience=constants.CLIENT_ID, issuer=ISSUER)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    verifier = jwt_backends.JoseVerifier()
+    # auth0 usually publishes the current key and the next one
+    pem, signing_key = make_key("current")
+    _, next_key = make_key("next")
+    key_set = {"keys": [next_key, signing_key]}
+    token = make_token(pem, "current")
+    index = jwks.JWKSCache(constants.JWKS_URL, verifier.load_key)._index(key_set)
+
+    def new_verify(token, index):
+        unverified_header = verifier.get_unverified_header(token)
+        return verifier.verify(token, index[unverified_header["kid"]],
+                               audience=constants.CLIENT_ID, issuer=ISSUER)
+
+    assert old_verify(token, key_set) == new_verify(token, index)
+    for name, func, arg in (("old (scan + dict)", old_verify, key_set),
+                            ("new (kid index)", new_verify, index)):
+        seconds = min(timeit.repeat(lambda: func(token, arg), number=iterations, repeat=3))
+        print("%-18s %8.1f us/verify" % (name, seconds / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main()
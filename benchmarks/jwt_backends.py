@@ -0,0 +1,49 @@
+# verifications/sec and latency percentiles for every backend in
+# jwt_backends.VERIFIERS, against tokens signed locally with a generated key.
+#   python benchmarks/jwt_backends.py [iterations]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import constants
+import jwt_backends
+from local_keys import ISSUER, make_key, make_token
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(verifier, jwk, tokens, iterations):
+    key = verifier.load_key(jwk)
+    # warm up, and make sure the backend actually accepts the tokens
+    for token in tokens:
+        assert verifier.verify(token, key, audience=constants.CLIENT_ID, issuer=ISSUER)["sub"]
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        token = tokens[i % len(tokens)]
+        t0 = time.perf_counter()
+        verifier.get_unverified_header(token)
+        verifier.verify(token, key, audience=constants.CLIENT_ID, issuer=ISSUER)
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return iterations / elapsed, percentile(samples, 50), percentile(samples, 99)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    pem, jwk = make_key("bench")
+    tokens = [make_token(pem, "bench", sub="bench|" + str(i)) for i in range(50)]
+    print("%-14s %12s %10s %10s" % ("backend", "verify/s", "p50 us", "p99 us"))
+    for name in sorted(jwt_backends.VERIFIERS):
+        rate, p50, p99 = run(jwt_backends.get_verifier(name), jwk, tokens, iterations)
+        print("%-14s %12.0f %10.1f %10.1f" % (name, rate, p50 * 1e6, p99 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+# locally generated RS256 keys and tokens for the auth benchmarks,
+# shaped like what auth0 publishes and issues
+import base64
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+import constants
+
+ISSUER = "https://" + constants.DOMAIN + "/"
+
+
+def b64_int(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+# returns the private key as pem and the public half as a jwk
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    numbers = private_key.public_key().public_numbers()
+    pem = private_key.private_bytes(serialization.Encoding.PEM,
+                                    serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode('ascii')
+    public = {"kty": "RSA", "kid": kid, "use": "sig", "alg": "RS256",
+              "n": b64_int(numbers.n), "e": b64_int(numbers.e)}
+    return pem, public
+
+
+def make_token(pem, kid, sub="bench|user", lifetime=3600):
+    now = int(time.time())
+    claims = {"sub": sub, "aud": constants.CLIENT_ID, "iss": ISSUER,
+              "iat": now, "exp": now + lifetime}
+    return jwt.encode(claims, pem, algorithm='RS256', headers={"kid": kid})
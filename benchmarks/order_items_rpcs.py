@@ -0,0 +1,52 @@
+# datastore rpcs for GET /orders/<id>/items against fake_datastore, paging
+# through an order with many items, some of them deleted without being
+# unlinked. fails if a page costs more than the order lookup plus one
+# get_multi, or if anything is written.
+#   python benchmarks/order_items_rpcs.py [items] [limit]
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g
+import fake_datastore
+
+fake_datastore.install()
+
+import orders
+
+OWNER = "auth0|bench"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    client = fake_datastore.FakeClient()
+    orders.client = client
+    order, item_list = fake_datastore.make_order(client, OWNER, count)
+    # every tenth item is gone but still listed on the order
+    client.delete_multi([item.key for item in item_list[::10]])
+    expected = count - len(item_list[::10])
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    url = '/orders/%d/items?limit=%d' % (order.key.id, limit)
+    returned = pages = 0
+    client.reset()
+    while url:
+        with app.test_request_context(url, base_url='http://localhost/'):
+            g.payload = {"sub": OWNER}
+            response, status = orders.items_get_specific(str(order.key.id))
+            assert status == 200, status
+            returned += len(response.get_json())
+            link = response.headers.get('Link')
+            url = link[len('<http://localhost'):link.index('>')] if link else None
+        pages += 1
+    print("%d items (%d missing) in %d pages: %s" % (
+        count, count - expected, pages, ", ".join("%s=%d" % kv for kv in sorted(client.rpcs.items()))))
+    assert returned == expected, returned
+    assert client.rpcs == {"lookup": 2 * pages}, client.rpcs
+    print("%.1f rpcs per page, no writes (the old loop made %d)" % (client.total_rpcs() / float(pages), 2 * count + 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# datastore rpcs and latency per POST/PUT of an order and an item, answering
+# from the written entity versus reading it back (constants.VERIFY_WRITES, what
+# every write used to do). runs the real POST and PUT views against
+# fake_datastore with a simulated round trip per rpc.
+#   python benchmarks/write_rpcs.py [requests] [rpc_latency_ms]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g
+import fake_datastore
+
+fake_datastore.install()
+
+import constants
+import items
+import orders
+
+ORDER = {"has_shipped": False, "date": "2021-06-01", "location": "Portland"}
+ITEM = {"item_name": "widget", "quantity": 3, "item_description": "a widget"}
+OWNER = "auth0|bench"
+
+app = Flask(__name__)
+
+
+def call(view, body, *args):
+    with app.test_request_context('/', base_url='http://localhost/', json=body):
+        g.payload = {"sub": OWNER}
+        response, status = view(*args)
+        assert status in (200, 201), status
+        return response.get_json()
+
+
+def post_order():
+    return call(orders.orders_post, ORDER)
+
+
+def put_order(order_id):
+    return call(orders.orders_put_specific, ORDER, str(order_id))
+
+
+def post_item():
+    return call(items.items_post, ITEM)
+
+
+def put_item(item_id):
+    return call(items.items_put_specific, ITEM, str(item_id))
+
+
+def measure(client, name, func, requests):
+    client.reset()
+    started = time.perf_counter()
+    for _ in range(requests):
+        func()
+    elapsed = time.perf_counter() - started
+    print("  %-10s %5.1f rpcs/request  %7.2f ms/request  %s" % (
+        name, client.total_rpcs() / float(requests), elapsed * 1000 / requests,
+        ", ".join("%s=%d" % kv for kv in sorted(client.rpcs.items()))))
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.002
+    client = fake_datastore.FakeClient(latency=latency)
+    orders.client = items.client = client
+    order_id = post_order()["id"]
+    item_id = post_item()["id"]
+    for verify in (True, False):
+        constants.VERIFY_WRITES = verify
+        print("read back after write" if verify else "answer from the written entity")
+        measure(client, "POST order", post_order, requests)
+        measure(client, "PUT order", lambda: put_order(order_id), requests)
+        measure(client, "POST item", post_item, requests)
+        measure(client, "PUT item", lambda: put_item(item_id), requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import threading
+import time
+import requests
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    pass
+
+
+class BulkheadFull(requests.exceptions.RequestException):
+    pass
+
+
+# stops calling a dependency after failure_threshold failures in a row. once
+# reset_timeout has passed a single probe call is let through (half open): if it
+# works the circuit closes again, if not it stays open for another reset_timeout.
+class CircuitBreaker(object):
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpen("Circuit for " + self.name + " is open")
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+            self._probing = False
+
+    def status(self):
+        with self._lock:
+            status = {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+            if self.state != CLOSED:
+                status["retry_in"] = max(0, round(self.opened_at + self.reset_timeout - time.time(), 1))
+            return status
+
+
+# caps how many threads can be inside calls to one dependency, so a slow
+# dependency can only tie up max_concurrent request threads. callers that find
+# it full wait at most wait seconds, keep it short: a waiting thread is tied up too
+class Bulkhead(object):
+    def __init__(self, name, max_concurrent, wait):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.wait = wait
+        self.in_use = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        if not self._slots.acquire(timeout=self.wait):
+            with self._lock:
+                self.rejected += 1
+            raise BulkheadFull("Too many concurrent calls to " + self.name)
+        with self._lock:
+            self.in_use += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+        return False
+
+    def status(self):
+        with self._lock:
+            return {"in_use": self.in_use, "max_concurrent": self.max_concurrent,
+                    "rejected": self.rejected}
@@ -0,0 +1,11 @@
+# deletes expired SESSIONS entities. a session is only dropped when its id comes
+# back after it expired, so the ones that are never presented again pile up;
+# run this from cron (or by hand) to remove them.
+#   python cleanup_sessions.py
+from google.cloud import datastore
+import sessions
+
+
+if __name__ == '__main__':
+    store = sessions.DatastoreSessionStore(datastore.Client())
+    print("deleted %d expired sessions" % store.delete_expired())
@@ -6,3 +6,66 @@ DOMAIN = 'cloud-computing-2021.us.auth0.com'
 # CALLBACK_URL = 'http://localhost:8080/callback'
 CALLBACK_URL = 'https://final-project-314821.wm.r.appspot.com/callback'
 ALGORITHMS = ["RS256"]
+# jwks caching
+JWKS_URL = "https://" + DOMAIN + "/.well-known/jwks.json"
+# seconds to keep the key set when auth0 does not send a max-age
+JWKS_CACHE_TTL = 600
+# an unknown kid can force a refetch at most this often (seconds)
+JWKS_MIN_REFRESH_INTERVAL = 30
+JWKS_FETCH_TIMEOUT = 5
+# verified tokens kept in memory, each one until its exp
+TOKEN_CACHE_SIZE = 1024
+# jwt verification backend, see jwt_backends.VERIFIERS ('jose' or 'cryptography')
+JWT_BACKEND = 'jose'
+# rejected tokens are answered from memory for this many seconds
+REJECTED_TOKEN_CACHE_SIZE = 1024
+REJECTED_TOKEN_TTL = 30
+# auth failures allowed per client before it gets 429s for the rest of the window
+AUTH_FAILURE_LIMIT = 20
+AUTH_FAILURE_WINDOW = 60
+# cache shared by the worker processes on a node (mmap'd file), None turns it off
+SHARED_CACHE_PATH = None
+SHARED_CACHE_TOKEN_SLOTS = 4096
+SHARED_CACHE_TOKEN_SLOT_SIZE = 2048
+SHARED_CACHE_JWKS_SLOT_SIZE = 65536
+# outbound http (auth0)
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 10
+# concurrent requests allowed to one host. extra callers wait this long (seconds)
+# for a slot and are then rejected, a waiting caller still holds a worker thread
+HTTP_MAX_PER_HOST = 8
+HTTP_BULKHEAD_WAIT = 0.05
+# auth0 circuit breakers: open after this many failures in a row, probe again after the timeout
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+# server-side sessions: 'datastore' (shared by all instances) or 'memory' (one process)
+SESSION_BACKEND = 'datastore'
+SESSION_TTL = 86400
+SESSION_CACHE_SIZE = 1000
+# ui login callback
+USERINFO_CACHE_SIZE = 1000
+USERINFO_CACHE_TTL = 300
+# write-behind queue for bookkeeping writes (users)
+WRITE_BEHIND_QUEUE_SIZE = 1000
+WRITE_BEHIND_BATCH_SIZE = 100
+WRITE_BEHIND_FLUSH_INTERVAL = 0.5
+# list endpoints
+PAGE_DEFAULT_LIMIT = 5
+PAGE_MAX_LIMIT = 100
+PAGE_MAX_OFFSET = 1000
+# keys per get_multi/put_multi/delete_multi call, datastore allows 500 writes per commit
+DATASTORE_BATCH_SIZE = 500
+# bodies accepted by POST /orders:batch and /items:batch
+CREATE_BATCH_MAX = 1000
+# ids accepted by POST /orders:bulk-ship and /orders:bulk-delete
+BULK_MAX_IDS = 10000
+# per-owner counters
+COUNTER_SHARDS = 4
+# datastore transactions: attempts on contention, the first backoff and the longest one (seconds)
+TXN_MAX_ATTEMPTS = 5
+TXN_BASE_DELAY = 0.05
+TXN_MAX_DELAY = 1.0
+# read entities back after writing them and answer with the stored copy
+# (lookups by key are strongly consistent). off: answer from what was written
+VERIFY_WRITES = False
@@ -0,0 +1,84 @@
+import random
+from google.cloud import datastore
+import constants
+import transactions
+
+# number of entities each owner has of a kind, kept up to date on create and
+# delete instead of being counted on every list request.
+# the count is spread over COUNTER_SHARDS shard entities so concurrent writes by
+# one owner don't all contend on the same entity. a "base" entity holds the
+# count the owner already had before counters existed; it is filled in from a
+# keys-only count the first time the total is read.
+COUNTERS = "counters"
+
+
+def shard_keys(client, kind, owner_id):
+    return [client.key(COUNTERS, "%s:%s:%d" % (kind, owner_id, i))
+            for i in range(constants.COUNTER_SHARDS)]
+
+
+def base_key(client, kind, owner_id):
+    return client.key(COUNTERS, "%s:%s" % (kind, owner_id))
+
+
+# must be called inside the transaction that creates/deletes the entities
+def increment(client, kind, owner_id, delta):
+    key = random.choice(shard_keys(client, kind, owner_id))
+    shard = client.get(key)
+    if shard is None:
+        shard = datastore.entity.Entity(key=key)
+        shard["count"] = 0
+    shard["count"] += delta
+    client.put(shard)
+
+
+def total(client, kind, owner_id):
+    keys = [base_key(client, kind, owner_id)] + shard_keys(client, kind, owner_id)
+    base, count = _read(client, keys)
+    if base is None:
+        return _seed(client, kind, owner_id, keys)
+    return base["count"] + count
+
+
+def _read(client, keys):
+    base = None
+    count = 0
+    for entity in client.get_multi(keys):
+        if entity.key == keys[0]:
+            base = entity
+        else:
+            count += entity["count"]
+    return base, count
+
+
+# first read for this owner: count what is stored (keys only, no entity reads)
+# and keep whatever the shards don't already account for as the base. a create
+# or delete that commits while the query runs would be in the shards but not in
+# the count (or the other way round), so the shards are read before the query
+# and the seed only goes ahead if they are unchanged inside the transaction
+def _seed(client, kind, owner_id, keys):
+    query = client.query(kind=kind)
+    query.add_filter("owner_id", "=", owner_id)
+    query.keys_only()
+    stored = None
+    for attempt in range(constants.TXN_MAX_ATTEMPTS):
+        base, before = _read(client, keys)
+        if base is not None:
+            return base["count"] + before
+        stored = sum(1 for _ in query.fetch())
+
+        def seed():
+            base, count = _read(client, keys)
+            if base is not None:
+                return base["count"] + count
+            if count != before:
+                return None
+            base = datastore.entity.Entity(key=keys[0])
+            base["count"] = stored - count
+            client.put(base)
+            return stored
+        seeded = transactions.run_in_transaction(client, seed)
+        if seeded is not None:
+            return seeded
+    # still busy, answer with the count and seed on a later read
+    return stored
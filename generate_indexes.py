@@ -0,0 +1,49 @@
+# writes index.yaml with a composite index for every filter/sort combination
+# GET /orders and GET /items accept (see query_params), plus the fixed ones below.
+# re-run it after changing an allow-list, then deploy the indexes before the code:
+#   python generate_indexes.py [--check]
+#   gcloud datastore indexes create index.yaml
+import sys
+import query_params
+
+INDEX_FILE = 'index.yaml'
+
+# indexes that don't come from a list allow-list, (comment, kind, properties)
+FIXED = [
+    ("GET /users projects every user onto these properties",
+     'USERS', (("name", "asc"), ("user_id", "asc"))),
+]
+
+
+def build():
+    lines = ["# generated by generate_indexes.py, edit that instead", "indexes:"]
+    for comment, kind, props in FIXED:
+        lines.append("")
+        lines.append("# " + comment)
+        lines.extend(index_lines(kind, props))
+    for spec in query_params.SPECS:
+        lines.append("")
+        lines.append("# GET /" + spec.kind + " filters and sorts, always scoped to the owner")
+        for props in spec.all_indexes():
+            lines.extend(index_lines(spec.kind, (("owner_id", "asc"),) + props))
+    return "\n".join(lines) + "\n"
+
+
+def index_lines(kind, props):
+    lines = ["- kind: " + kind, "  properties:"]
+    for name, direction in props:
+        lines.append("  - name: " + name)
+        if direction != "asc":
+            lines.append("    direction: " + direction)
+    return lines
+
+
+if __name__ == '__main__':
+    text = build()
+    if '--check' in sys.argv[1:]:
+        with open(INDEX_FILE) as f:
+            if f.read() != text:
+                sys.exit(INDEX_FILE + " is out of date, run python generate_indexes.py")
+    else:
+        with open(INDEX_FILE, 'w') as f:
+            f.write(text)
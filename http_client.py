@@ -0,0 +1,98 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from six.moves import http_cookiejar
+from six.moves.urllib.parse import urlsplit
+import circuit_breaker
+import constants
+
+# every outbound call (auth0 token, jwks, userinfo) goes through one adapter, so
+# they share keep-alive connections and always have a timeout. each host gets a
+# bulkhead (at most max_per_host calls in flight) and each endpoint a circuit
+# breaker, so a degraded auth0 fails fast instead of holding request threads.
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, timeout, max_per_host, pool_size, bulkhead_wait):
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.bulkhead_wait = bulkhead_wait
+        self.bulkheads = {}
+        self.breakers = {}
+        self._lock = threading.Lock()
+        super(PooledAdapter, self).__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def _bulkhead(self, host):
+        with self._lock:
+            if host not in self.bulkheads:
+                self.bulkheads[host] = circuit_breaker.Bulkhead(host, self.max_per_host, self.bulkhead_wait)
+            return self.bulkheads[host]
+
+    def _breaker(self, endpoint):
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = circuit_breaker.CircuitBreaker(
+                    endpoint, constants.BREAKER_FAILURE_THRESHOLD, constants.BREAKER_RESET_TIMEOUT)
+            return self.breakers[endpoint]
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if timeout is None:
+            timeout = self.timeout
+        url = urlsplit(request.url)
+        breaker = self._breaker(url.netloc + url.path)
+        with self._bulkhead(url.netloc):
+            breaker.before_call()
+            try:
+                response = super(PooledAdapter, self).send(request, stream=stream, timeout=timeout,
+                                                           verify=verify, cert=cert, proxies=proxies)
+            except requests.exceptions.RequestException:
+                breaker.record_failure()
+                raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    # sessions that borrow the adapter close it when they are done with it,
+    # the pool has to outlive them
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super(PooledAdapter, self).close()
+
+
+adapter = PooledAdapter((constants.HTTP_CONNECT_TIMEOUT, constants.HTTP_READ_TIMEOUT),
+                        constants.HTTP_MAX_PER_HOST, constants.HTTP_POOL_SIZE,
+                        constants.HTTP_BULKHEAD_WAIT)
+
+
+# point a requests session at the shared pool, also used as the authlib
+# compliance_fix so the auth0 oauth sessions use it
+def mount(session):
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# shared by every user's login and the jwks fetch, so it must never keep a
+# cookie one response sets and send it with someone else's request
+session = mount(requests.Session())
+session.cookies.set_policy(http_cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+
+def get(url, **kwargs):
+    return session.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return session.post(url, **kwargs)
+
+
+def status():
+    with adapter._lock:
+        breakers = dict(adapter.breakers)
+        bulkheads = dict(adapter.bulkheads)
+    return {"breakers": dict((name, b.status()) for name, b in breakers.items()),
+            "bulkheads": dict((name, b.status()) for name, b in bulkheads.items())}
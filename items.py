@@ -1,30 +1,50 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, g, request, jsonify
 from google.cloud import datastore
-import jwt_functions
+import auth
+import batches
+import constants
+import counters
+import links
+import merge_patch
+import pagination
+import query_params
+import transactions
 
 client = datastore.Client()
 
 bp = Blueprint('items', __name__, url_prefix='/items')
+auth.require_auth(bp)
 ITEMS = "items"
+# what PATCH may change, all of them required
+ITEM_FIELDS = ("item_name", "quantity", "item_description")
 ORDERS = "orders"
 
 
-# function to check for json request and authorization
-def check_auth_accept(header):
-    if (header['Accept'] != 'application/json') and (header['Accept'] != '*/*'):
-        return jsonify({"Error": "Please make sure the accept is json."}), 406
-    # if missing/invalid JWT return 401
-    if 'Authorization' not in header:
-        return jsonify({"Error": "Missing auth credentials."}), 401
-    return None
+# properties of an item from a request body, KeyError when one is missing
+def item_properties(content, owner_id):
+    return {"item_name": content["item_name"], "quantity": content["quantity"],
+            "item_description": content["item_description"], "owner_id": owner_id}
 
 
 # function to update a item entity
-def update_item(entity, content, owner_id):
-    entity.update({"item_name": content["item_name"], "quantity": content["quantity"],
-                   "item_description": content["item_description"], "owner_id": owner_id})
-    client.put(entity)
-    result = client.get(entity.key)
+def update_item(entity, content, owner_id, created=False):
+    entity.update(item_properties(content, owner_id))
+    if created:
+        # the new entity and the owner's count are written together
+        def create():
+            client.put(entity)
+            counters.increment(client, ITEMS, owner_id, 1)
+        transactions.run_in_transaction(client, create)
+    else:
+        # replacing: the caller read the entity in the transaction this runs in
+        client.put(entity)
+    return entity
+
+
+# response body for an item that was just written
+def item_result(entity):
+    # the put completed the key, the rest is what was just written
+    result = client.get(entity.key) if constants.VERIFY_WRITES else dict(entity)
     result["id"] = entity.key.id
     result["self"] = request.url_root + 'items/' + str(entity.key.id)
     return result
@@ -32,54 +52,79 @@ def update_item(entity, content, owner_id):
 
 @bp.route('', methods=['POST'])
 def items_post():
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     owner_id = payload["sub"]
     try:
         content = request.get_json()
         new_item = datastore.entity.Entity(key=client.key(ITEMS))
-        result = update_item(new_item, content, owner_id)
+        result = item_result(update_item(new_item, content, owner_id, created=True))
         return jsonify(result), 201
     except KeyError:
         return jsonify({"Error": "The request object is missing at least one of the required attributes"}), 400
 
 
+# create many items at once from a JSON array of bodies. every body is checked
+# before anything is written, and the answer has a result per body in the same
+# order: 201 when all of them were created, 207 when some weren't.
+def items_post_batch():
+    payload = g.payload
+    owner_id = payload["sub"]
+    bodies = request.get_json(silent=True)
+    if not isinstance(bodies, list) or not 0 < len(bodies) <= constants.CREATE_BATCH_MAX:
+        return jsonify({"Error": "The request body must be an array of 1 to "
+                        + str(constants.CREATE_BATCH_MAX) + " items"}), 400
+    results = [None] * len(bodies)
+    valid = []
+    for i, content in enumerate(bodies):
+        try:
+            valid.append((i, item_properties(content, owner_id)))
+        except (KeyError, TypeError):
+            results[i] = {"status": 400,
+                          "Error": "The request object is missing at least one of the required attributes"}
+    entities, errors = batches.create_multi(client, ITEMS, owner_id, [props for i, props in valid])
+    for (i, props), entity, error in zip(valid, entities, errors):
+        if error:
+            results[i] = {"status": 503, "Error": error}
+        else:
+            result = dict(entity)
+            result["id"] = entity.key.id
+            result["self"] = request.url_root + 'items/' + str(entity.key.id)
+            results[i] = {"status": 201, "item": result}
+    status = 201 if all(result["status"] == 201 for result in results) else 207
+    return jsonify({"results": results}), status
+
+
+# POST /items:batch isn't under the blueprint's /items/ prefix, so it is added to
+# the app directly, under the blueprint's endpoint name so auth still applies
+@bp.record
+def add_batch_route(state):
+    state.app.add_url_rule(state.url_prefix + ':batch', bp.name + '.items_post_batch',
+                           items_post_batch, methods=['POST'])
+
+
 @bp.route('', methods=['GET'])
 def items_get():
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     query = client.query(kind=ITEMS)
     query.add_filter("owner_id", "=", payload["sub"])
-    item_total = len(list(query.fetch()))
-    q_limit = int(request.args.get('limit', '5'))
-    q_offset = int(request.args.get('offset', '0'))
-    g_iterator = query.fetch(limit=q_limit, offset=q_offset)
-    pages = g_iterator.pages
-    results = list(next(pages))
-    if g_iterator.next_page_token:
-        next_offset = q_offset + q_limit
-        next_url = request.base_url + "?limit=" + str(q_limit) + "&offset=" + str(next_offset)
-    else:
-        next_url = None
+    try:
+        page = pagination.PageRequest(ITEMS, payload["sub"], request.args, query_params.ITEMS)
+        results, next_url = page.fetch(query)
+    except pagination.BadPage as e:
+        return jsonify({"Error": str(e)}), 400
     for e in results:
         e["id"] = e.key.id
         e["self"] = request.url_root + 'items/' + str(e.key.id)
-        e["total_items"] = item_total
-    output = {"items": results}
+    fields = page.params.get("fields")
+    output = {"items": [query_params.select(e, fields) for e in results],
+              "total_items": counters.total(client, ITEMS, payload["sub"])}
     if next_url:
         output["next"] = next_url
     return jsonify(output), 200
 
 
 @bp.route('', methods=['PUT', 'DELETE'])
+@auth.public
 def items_invalid():
     # not allowed to put or delete on the entire list of entities
     return jsonify({"Error": "These operations are not allowed on the entire list."}), 405
@@ -88,12 +133,11 @@ def items_invalid():
 # get a specified item's info
 @bp.route('/<id>', methods=['GET'])
 def items_get_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
+    try:
+        fields = query_params.ITEMS.parse_fields(request.args)
+    except query_params.BadQuery as e:
+        return jsonify({"Error": str(e)}), 400
     item_key = client.key(ITEMS, int(id))
     item = client.get(key=item_key)
     if not item:
@@ -102,29 +146,36 @@ def items_get_specific(id):
         return jsonify({"Error": "You are unauthorized to view this."}), 403
     item["id"] = item.key.id
     item["self"] = request.url_root + 'items/' + str(item.key.id)
-    return jsonify(item)
+    return jsonify(query_params.select(item, fields))
 
 
 @bp.route('/<id>', methods=['PATCH'])
 def items_patch_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
-    content = request.get_json()
-    # make sure new requested name is not a duplicate
+    payload = g.payload
+    content = request.get_json(force=True, silent=True)
     item_key = client.key(ITEMS, int(id))
-    item = client.get(key=item_key)
-    if not item:
-        return jsonify({"Error": "No item with this item_id exists"}), 404
-    if item["owner_id"] != payload["sub"]:
-        return jsonify({"Error": "You are unauthorized to view this."}), 403
-    for key in content:
-        if item[key]:
-            item[key] = content[key]
+
+    # the patch is applied to a plain read first, so one that changes nothing
+    # costs a single lookup. a real change is re-read, re-applied and written
+    # once in a transaction, so a concurrent attach/detach isn't undone
+    def patch(write):
+        item = client.get(key=item_key)
+        if not item:
+            return None, False, (jsonify({"Error": "No item with this item_id exists"}), 404)
+        if item["owner_id"] != payload["sub"]:
+            return None, False, (jsonify({"Error": "You are unauthorized to view this."}), 403)
+        try:
+            changed = merge_patch.apply(item, content, ITEM_FIELDS, required=ITEM_FIELDS)
+        except merge_patch.PatchError as e:
+            return None, False, (jsonify({"Error": str(e)}), 400)
+        if changed and write:
             client.put(item)
+        return item, changed, None
+    item, changed, error = patch(False)
+    if changed:
+        item, changed, error = transactions.run_in_transaction(client, lambda: patch(True))
+    if error:
+        return error
     item["id"] = item.key.id
     item["self"] = request.url_root + 'items/' + str(item.key.id)
     return jsonify(item), 200
@@ -132,55 +183,54 @@ def items_patch_specific(id):
 
 @bp.route('/<id>', methods=['PUT'])
 def items_put_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
-    try:
-        content = request.get_json()
-        item_key = client.key(ITEMS, int(id))
+    payload = g.payload
+    content = request.get_json()
+    item_key = client.key(ITEMS, int(id))
+
+    # read and replace in one transaction, so a concurrent attach/detach isn't undone
+    def replace():
         item = client.get(key=item_key)
         if not item:
-            return jsonify({"Error": "No item with this item_id exists"}), 404
+            return None, (jsonify({"Error": "No item with this item_id exists"}), 404)
         if item["owner_id"] != payload["sub"]:
-            return jsonify({"Error": "You are unauthorized to view this."}), 403
-        owner_id = payload["sub"]
-        result = update_item(item, content, owner_id)
-        return jsonify(result), 200
+            return None, (jsonify({"Error": "You are unauthorized to view this."}), 403)
+        return update_item(item, content, payload["sub"]), None
+    try:
+        item, error = transactions.run_in_transaction(client, replace)
     except KeyError:
         return jsonify({"Error": "The request object is missing at least one of the required attributes"}), 400
+    if error:
+        return error
+    return jsonify(item_result(item)), 200
 
 
 @bp.route('/<id>', methods=['DELETE'])
 def items_delete_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     item_key = client.key(ITEMS, int(id))
     item = client.get(key=item_key)
     if not item:
         return jsonify({"Error": "No item with this item_id exists"}), 404
     if item["owner_id"] != payload["sub"]:
         return jsonify({"Error": "You are unauthorized to view this."}), 403
-    # check if item is on a order and remove it
-    if 'orders' in item.keys() and item['orders'] is not None:
-        order_key = client.key(ORDERS, item['orders']['id'])
-        order = client.get(key=order_key)
-        # update order to remove this item
-        if 'items' in order.keys() and order['items'] is not None:
-            i = 0
-            length = len(order['items'])
-            while i < length:
-                if item.key.id == order['items'][i]['id']:
-                    order['items'].pop(i)
-                    length = len(order['items'])
-                    client.put(order)
-                else:
-                    i += 1
-    client.delete(item_key)
+    order_keys = [client.key(ORDERS, order_id) for order_id in links.order_ids(item)]
+
+    # the item comes off its order in the transaction that deletes it, and the
+    # delete is only counted if it wasn't deleted concurrently
+    def delete():
+        entities = batches.get_multi(client, [item_key] + order_keys)
+        if entities[0] is None:
+            return
+        orders = entities[1:]
+        # put on an order since the item was first read
+        added = [client.key(ORDERS, order_id) for order_id in links.order_ids(entities[0])
+                 if client.key(ORDERS, order_id) not in order_keys]
+        if added:
+            orders += batches.get_multi(client, added)
+        orders = [order for order in orders if order is not None and links.unlink_item(order, item.key.id)]
+        if orders:
+            client.put_multi(orders)
+        client.delete(item_key)
+        counters.increment(client, ITEMS, payload["sub"], -1)
+    transactions.run_in_transaction(client, delete)
     return jsonify(''), 204
@@ -0,0 +1,145 @@
+import logging
+import re
+import threading
+import time
+import constants
+import http_client
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+# read the max-age out of a Cache-Control header, None when there isn't a usable one
+def parse_max_age(cache_control):
+    if not cache_control:
+        return None
+    directives = cache_control.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    match = MAX_AGE_RE.search(directives)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+# process-wide store for the auth0 signing keys.
+# keys are kept until the ttl runs out (or the max-age auth0 sends), and a token
+# signed with a kid we have not seen forces a refetch, at most once per
+# min_refresh_interval. only one thread fetches at a time, everyone else waits
+# on the lock and then uses whatever that fetch stored.
+# load_key turns a jwk into the key object the verification backend wants.
+# with a shared cache (see shared_cache.SharedCache) a document another worker
+# process fetched is used instead of fetching it again.
+class JWKSCache(object):
+    def __init__(self, url, load_key, ttl=constants.JWKS_CACHE_TTL,
+                 min_refresh_interval=constants.JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=constants.JWKS_FETCH_TIMEOUT, shared=None):
+        self.url = url
+        self.load_key = load_key
+        self.shared = shared
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._expires_at = 0
+        self._last_fetch = 0
+        self._generation = 0
+        self._fetch_lock = threading.Lock()
+
+    # return the key for this kid, or None if auth0 does not know it either
+    def get_key(self, kid):
+        generation = self._generation
+        keys = self._keys
+        now = time.time()
+        if now < self._expires_at:
+            if kid in keys:
+                return keys[kid]
+            # unknown kid, but don't let random kids hammer the endpoint
+            if now - self._last_fetch < self.min_refresh_interval:
+                return None
+        self._refresh(generation)
+        return self._keys.get(kid)
+
+    def status(self):
+        now = time.time()
+        return {"kids": sorted(self._keys),
+                "stale": now >= self._expires_at,
+                "expires_in": max(0, round(self._expires_at - now, 1))}
+
+    def clear(self):
+        with self._fetch_lock:
+            self._keys = {}
+            self._expires_at = 0
+            self._last_fetch = 0
+            self._generation += 1
+
+    def _refresh(self, seen_generation):
+        with self._fetch_lock:
+            # another thread refreshed while we were waiting for the lock
+            if self._generation != seen_generation:
+                return
+            now = time.time()
+            if self._load_shared(now):
+                return
+            try:
+                jwks, max_age = self._fetch()
+            except Exception:
+                # last known good keys, from this process or another worker
+                if not self._keys and not self._load_shared(now, allow_stale=True):
+                    raise
+                # keep serving the old keys and try again after the refresh interval
+                logger.exception("Unable to refresh JWKS, keeping cached keys")
+                self._last_fetch = now
+                self._expires_at = now + self.min_refresh_interval
+                self._generation += 1
+                return
+            self._keys = self._index(jwks)
+            self._last_fetch = now
+            # no-cache / max-age=0 still keeps the keys for the refresh interval,
+            # otherwise every request would fetch them again
+            ttl = self.ttl if max_age is None else max(max_age, self.min_refresh_interval)
+            self._expires_at = now + ttl
+            self._generation += 1
+            if self.shared is not None:
+                self.shared.store_jwks(jwks, now, self._expires_at)
+
+    # use the document from the shared cache if some process fetched it after we
+    # last did and it has not expired yet (or at all, when allow_stale is set)
+    def _load_shared(self, now, allow_stale=False):
+        if self.shared is None:
+            return False
+        try:
+            shared = self.shared.load_jwks()
+        except Exception:
+            logger.exception("Unable to read JWKS from the shared cache")
+            return False
+        if shared is None:
+            return False
+        jwks, fetched_at, expires_at = shared
+        if fetched_at <= self._last_fetch or (now >= expires_at and not allow_stale):
+            return False
+        self._keys = self._index(jwks)
+        self._last_fetch = fetched_at
+        self._expires_at = expires_at
+        self._generation += 1
+        return True
+
+    def _fetch(self):
+        response = http_client.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json(), parse_max_age(response.headers.get('Cache-Control'))
+
+    # kid -> ready to use public key, built once per fetch instead of once per request
+    def _index(self, jwks):
+        keys = {}
+        for key in jwks["keys"]:
+            if key.get("use", "sig") != "sig" or key.get("kty") != "RSA":
+                continue
+            if key.get("alg", constants.ALGORITHMS[0]) != constants.ALGORITHMS[0]:
+                continue
+            try:
+                keys[key["kid"]] = self.load_key(key)
+            except Exception:
+                logger.exception("Skipping unusable JWKS key %s", key.get("kid"))
+        return keys
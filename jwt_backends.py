@@ -0,0 +1,156 @@
+import json
+import time
+from jose import jwk, jwt
+from jose.utils import base64url_decode
+import constants
+
+# verification backends for jwt_functions.verify_jwt.
+# every backend turns a jwk into a key object once (the jwks cache keeps it) and
+# then checks tokens against that key, so backends can be swapped with
+# constants.JWT_BACKEND without touching the request handling.
+
+
+class VerificationError(Exception):
+    pass
+
+
+class InvalidToken(VerificationError):
+    pass
+
+
+class TokenExpired(VerificationError):
+    pass
+
+
+class InvalidClaims(VerificationError):
+    pass
+
+
+def split_token(token):
+    if isinstance(token, str):
+        token = token.encode('utf-8')
+    try:
+        signing_input, signature = token.rsplit(b'.', 1)
+        header_segment, payload_segment = signing_input.split(b'.', 1)
+    except ValueError:
+        raise InvalidToken("Not enough segments")
+    return header_segment, payload_segment, signing_input, signature
+
+
+def b64_json(segment):
+    try:
+        value = json.loads(base64url_decode(segment).decode('utf-8'))
+    except Exception:
+        raise InvalidToken("Invalid segment encoding")
+    if not isinstance(value, dict):
+        raise InvalidToken("Invalid segment")
+    return value
+
+
+# python-jose, the library the app has always used
+class JoseVerifier(object):
+    name = 'jose'
+
+    def load_key(self, key):
+        rsa_key = {
+            "kty": key["kty"],
+            "kid": key["kid"],
+            "use": key.get("use", "sig"),
+            "n": key["n"],
+            "e": key["e"]
+        }
+        return jwk.construct(rsa_key, constants.ALGORITHMS[0])
+
+    def get_unverified_header(self, token):
+        try:
+            return jwt.get_unverified_header(token)
+        except jwt.JWTError:
+            raise InvalidToken("Invalid header")
+
+    def verify(self, token, key, audience, issuer):
+        _, _, signing_input, signature = split_token(token)
+        try:
+            valid = key.verify(signing_input, base64url_decode(signature))
+        except Exception:
+            valid = False
+        if not valid:
+            raise InvalidToken("Signature verification failed")
+        try:
+            # signature is already checked, jose only validates the claims
+            return jwt.decode(token, None, algorithms=constants.ALGORITHMS,
+                              options={"verify_signature": False},
+                              audience=audience, issuer=issuer)
+        except jwt.ExpiredSignatureError:
+            raise TokenExpired("Signature has expired")
+        except jwt.JWTClaimsError as e:
+            raise InvalidClaims(str(e))
+        except Exception as e:
+            raise InvalidToken(str(e))
+
+
+# straight on top of the cryptography package, skips jose's generic key and
+# claim handling and only does what an RS256 auth0 token needs
+class CryptographyVerifier(object):
+    name = 'cryptography'
+
+    def __init__(self, leeway=0):
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding, rsa
+        from cryptography.exceptions import InvalidSignature
+        self.leeway = leeway
+        self._backend = default_backend()
+        self._hash = hashes.SHA256()
+        self._padding = padding.PKCS1v15()
+        self._rsa = rsa
+        self._invalid_signature = InvalidSignature
+
+    def load_key(self, key):
+        n = int.from_bytes(base64url_decode(key["n"].encode('ascii')), 'big')
+        e = int.from_bytes(base64url_decode(key["e"].encode('ascii')), 'big')
+        return self._rsa.RSAPublicNumbers(e, n).public_key(self._backend)
+
+    def get_unverified_header(self, token):
+        header_segment, _, _, _ = split_token(token)
+        return b64_json(header_segment)
+
+    def verify(self, token, key, audience, issuer):
+        header_segment, payload_segment, signing_input, signature = split_token(token)
+        if b64_json(header_segment).get("alg") not in constants.ALGORITHMS:
+            raise InvalidToken("The specified alg value is not allowed")
+        try:
+            key.verify(base64url_decode(signature), signing_input, self._padding, self._hash)
+        except (self._invalid_signature, ValueError, TypeError):
+            raise InvalidToken("Signature verification failed")
+        claims = b64_json(payload_segment)
+        self._validate_claims(claims, audience, issuer)
+        return claims
+
+    def _validate_claims(self, claims, audience, issuer):
+        now = time.time()
+        try:
+            if "nbf" in claims and now < int(claims["nbf"]) - self.leeway:
+                raise InvalidClaims("The token is not yet valid (nbf)")
+            if "exp" in claims and now > int(claims["exp"]) + self.leeway:
+                raise TokenExpired("Signature has expired")
+        except (TypeError, ValueError):
+            raise InvalidClaims("Invalid time claim")
+        aud = claims.get("aud")
+        if isinstance(aud, str):
+            aud = [aud]
+        if aud is None or audience not in aud:
+            raise InvalidClaims("Invalid audience")
+        if claims.get("iss") != issuer:
+            raise InvalidClaims("Invalid issuer")
+
+
+VERIFIERS = {
+    JoseVerifier.name: JoseVerifier,
+    CryptographyVerifier.name: CryptographyVerifier,
+}
+
+
+def get_verifier(name):
+    if name not in VERIFIERS:
+        raise ValueError("Unknown JWT backend: " + str(name))
+    return VERIFIERS[name]()
@@ -1,11 +1,28 @@
 from flask import Flask, jsonify
-from six.moves.urllib.request import urlopen
-from jose import jwt
-import json
+import requests
 import constants
+import jwks
+import jwt_backends
+import shared_cache
+import token_cache
 
 
 app = Flask(__name__)
+verifier = jwt_backends.get_verifier(constants.JWT_BACKEND)
+# jwks and verified tokens shared with the other worker processes, when enabled
+shared = None
+if constants.SHARED_CACHE_PATH:
+    shared = shared_cache.SharedCache(constants.SHARED_CACHE_PATH,
+                                      constants.SHARED_CACHE_TOKEN_SLOTS,
+                                      constants.SHARED_CACHE_TOKEN_SLOT_SIZE,
+                                      constants.SHARED_CACHE_JWKS_SLOT_SIZE)
+# signing keys are shared by every request in this process
+jwks_cache = jwks.JWKSCache(constants.JWKS_URL, verifier.load_key, shared=shared)
+# payloads of tokens that already passed verification
+verified_tokens = token_cache.VerifiedTokenCache(constants.TOKEN_CACHE_SIZE)
+# tokens that failed verification recently, with the error they failed with
+rejected_tokens = token_cache.RejectedTokenCache(constants.REJECTED_TOKEN_CACHE_SIZE,
+                                                 constants.REJECTED_TOKEN_TTL)
 
 
 # This code is adapted from https://auth0.com/docs/quickstart/backend/python/
@@ -23,47 +40,101 @@ def handle_auth_error(ex):
     return response
 
 
-def verify_jwt(request):
+# errors that are about the state of the jwks cache rather than the token: an
+# unknown kid can be a key auth0 only just started signing with
+TRANSIENT_ERRORS = ("no_rsa_key",)
+
+
+# whether a failed verification says the token itself is bad, so it can be
+# remembered and counted against the client
+def is_token_error(ex):
+    return ex.status_code < 500 and ex.error.get("code") not in TRANSIENT_ERRORS
+
+
+def bearer_token(request):
     auth_header = request.headers['Authorization'].split()
-    token = auth_header[1]
+    if len(auth_header) != 2:
+        raise AuthError({"code": "invalid_header",
+                         "description":
+                             "Authorization header must be"
+                             " Bearer token"}, 401)
+    return auth_header[1]
+
+
+# payload of a token that already passed verification and hasn't expired, in
+# this process or another worker, or None
+def cached_payload(token):
+    payload = verified_tokens.get(token)
+    if payload is not None:
+        return payload
+    if shared is not None:
+        payload = shared.get_token(token)
+        if payload is not None:
+            verified_tokens.put(token, payload)
+            return payload
+    return None
 
-    jsonurl = urlopen("https://" + constants.DOMAIN + "/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
+
+def verify_jwt(request):
+    token = bearer_token(request)
+    payload = cached_payload(token)
+    if payload is not None:
+        return payload
+    return verify_token(token)
+
+
+def verify_token(token):
+    # same bad token seen recently, fail without the jwks lookup or crypto
+    rejected = rejected_tokens.get(token)
+    if rejected is not None:
+        raise AuthError(rejected.error, rejected.status_code)
     try:
-        unverified_header = jwt.get_unverified_header(token)
-    except jwt.JWTError:
+        payload = decode_token(token)
+    except AuthError as ex:
+        # only remember answers about the token itself, not outages or a
+        # signing key we haven't fetched yet
+        if is_token_error(ex):
+            rejected_tokens.put(token, ex)
+        raise
+    verified_tokens.put(token, payload)
+    if shared is not None:
+        shared.put_token(token, payload)
+    return payload
+
+
+def decode_token(token):
+    try:
+        unverified_header = verifier.get_unverified_header(token)
+    except jwt_backends.InvalidToken:
         raise AuthError({"code": "invalid_header",
                          "description":
                              "Invalid header. "
                              "Use an RS256 signed JWT Access Token"}, 401)
-    if unverified_header["alg"] == "HS256":
+    if unverified_header.get("alg") not in constants.ALGORITHMS:
         raise AuthError({"code": "invalid_header",
                          "description":
                              "Invalid header. "
                              "Use an RS256 signed JWT Access Token"}, 401)
-    rsa_key = {}
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"]
-            }
-    if rsa_key:
+    try:
+        public_key = jwks_cache.get_key(unverified_header.get("kid"))
+    except requests.exceptions.RequestException:
+        # no keys at all yet and auth0 can't be reached (or its circuit is open)
+        raise AuthError({"code": "jwks_unavailable",
+                         "description":
+                             "Unable to fetch the signing keys,"
+                             " try again later"}, 503)
+    if public_key is not None:
         try:
-            payload = jwt.decode(
+            payload = verifier.verify(
                 token,
-                rsa_key,
-                algorithms=constants.ALGORITHMS,
+                public_key,
                 audience=constants.CLIENT_ID,
                 issuer="https://" + constants.DOMAIN + "/"
             )
-        except jwt.ExpiredSignatureError:
+        except jwt_backends.TokenExpired:
             raise AuthError({"code": "token_expired",
                              "description": "token is expired"}, 401)
-        except jwt.JWTClaimsError:
+        except jwt_backends.InvalidClaims:
             raise AuthError({"code": "invalid_claims",
                              "description":
                                  "incorrect claims,"
@@ -0,0 +1,44 @@
+# the links between orders and items. an order keeps a list of {"id", "self"}
+# for its items; an item keeps the same for its order, stored as a single
+# embedded entity by put_items_on_order but as a list on some older rows, so
+# both shapes are read.
+
+
+def item_ids(order):
+    return [link['id'] for link in order.get('items') or []]
+
+
+def order_ids(item):
+    links = item.get('orders')
+    if not links:
+        return []
+    if isinstance(links, dict):
+        links = [links]
+    return [link['id'] for link in links]
+
+
+# drop the item from the order's list, returns whether it was there
+def unlink_item(order, item_id):
+    links = order.get('items') or []
+    kept = [link for link in links if link['id'] != item_id]
+    if len(kept) == len(links):
+        return False
+    order['items'] = kept
+    return True
+
+
+# drop the order from the item, returns whether it was there
+def unlink_order(item, order_id):
+    links = item.get('orders')
+    if not links:
+        return False
+    if isinstance(links, dict):
+        if links['id'] != order_id:
+            return False
+        item['orders'] = None
+        return True
+    kept = [link for link in links if link['id'] != order_id]
+    if len(kept) == len(links):
+        return False
+    item['orders'] = kept or None
+    return True
@@ -1,12 +1,22 @@
 from google.cloud import datastore
-from flask import Flask, jsonify, redirect, render_template, session, url_for, request, _request_ctx_stack
+from flask import Flask, Response, jsonify, redirect, render_template, session, url_for, request, \
+    stream_with_context, _request_ctx_stack
+from google.api_core import exceptions as api_exceptions
+import time
 import requests
 from six.moves.urllib.parse import urlencode
 import json
 from authlib.integrations.flask_client import OAuth
 import items
 import orders
+import pagination
+import auth
 import constants
+import http_client
+import jwt_functions
+import sessions
+import token_cache
+import write_behind
 
 # base code from Module 7 in CS493: Cloud Application Development
 
@@ -15,10 +25,25 @@ app.secret_key = 'SUPERSECRETKEY'
 app.register_blueprint(items.bp)
 app.register_blueprint(orders.bp)
 client = datastore.Client()
+# the session cookie only holds an id, the data is kept server side
+app.session_interface = sessions.make_session_interface(constants.SESSION_BACKEND, client,
+                                                        constants.SESSION_TTL,
+                                                        constants.SESSION_CACHE_SIZE)
 USERS = 'USERS'
+# properties returned for each user, fetched with a projection query
+USER_FIELDS = ["name", "user_id"]
+USERS_PAGE_LIMIT = 20
+USERS_MAX_LIMIT = 500
 ORDERS = 'ORDERS'
 ITEMS = 'ITEMS'
 
+# user bookkeeping writes, batched into put_multi off the request path
+user_writes = write_behind.WriteBehindQueue(client, constants.WRITE_BEHIND_QUEUE_SIZE,
+                                            constants.WRITE_BEHIND_BATCH_SIZE,
+                                            constants.WRITE_BEHIND_FLUSH_INTERVAL)
+# auth0 userinfo responses by sub, so a user logging in again skips that call
+userinfo_cache = token_cache.TokenCache(constants.USERINFO_CACHE_SIZE)
+
 oauth = OAuth(app)
 auth0 = oauth.register(
     'auth0',
@@ -30,9 +55,23 @@ auth0 = oauth.register(
     client_kwargs={
         'scope': 'openid profile email',
     },
+    # token and userinfo calls share the pooled, timeout-bounded http client
+    compliance_fix=http_client.mount,
 )
 
 
+# auth0 timed out, is failing, or its circuit breaker is open
+@app.errorhandler(requests.exceptions.RequestException)
+def handle_auth0_unavailable(ex):
+    return jsonify({"Error": "The authentication service is unavailable, try again later."}), 503
+
+
+# a transaction that kept losing to concurrent writes (see transactions.py)
+@app.errorhandler(api_exceptions.Conflict)
+def handle_contention(ex):
+    return jsonify({"Error": "Too many concurrent changes to this resource, try again."}), 409
+
+
 @app.route('/')
 def index():
     return render_template("home.html")
@@ -51,32 +90,62 @@ def login_user():
             }
     headers = {'content-type': 'application/json'}
     url = 'https://' + constants.DOMAIN + '/oauth/token'
-    r = requests.post(url, json=body, headers=headers)
+    r = http_client.post(url, json=body, headers=headers)
     return r.text, 200, {'Content-Type': 'application/json'}
 
 
+# users are keyed by their auth0 sub, so saving one is a single put of the same
+# entity no matter how often they log in. nothing in the login reads it back,
+# so it goes through the write-behind queue.
+def save_user(userinfo):
+    new_user = datastore.entity.Entity(key=client.key(USERS, userinfo["sub"]))
+    new_user.update({"user_id": userinfo["sub"], "name": userinfo["name"]})
+    user_writes.put(new_user)
+
+
+# verified claims of the id token, or None if it can't be verified here.
+# it is checked against the same jwks, audience and issuer as api tokens.
+def id_token_claims(id_token):
+    try:
+        claims = jwt_functions.decode_token(id_token)
+    except jwt_functions.AuthError:
+        return None
+    if "sub" not in claims:
+        return None
+    return claims
+
+
+# the profile fields the ui needs from a login
+PROFILE_CLAIMS = ("sub", "name", "picture")
+
+
+# profile for the user logging in. with the profile scope the verified id token
+# already carries it, auth0's userinfo endpoint is only asked (and cached) when
+# the token doesn't
+def get_userinfo(claims):
+    if claims is not None and all(claim in claims for claim in PROFILE_CLAIMS):
+        return claims
+    sub = claims["sub"] if claims is not None else None
+    userinfo = userinfo_cache.get(sub) if sub else None
+    if userinfo is None:
+        userinfo = auth0.get('userinfo').json()
+        userinfo_cache.set(userinfo["sub"], userinfo, time.time() + constants.USERINFO_CACHE_TTL)
+    return userinfo
+
+
 # retrieve user info to display on webpage
 @app.route('/callback')
 def callback_handling():
-    user_flag = False
     # Handles response from token endpoint
     id_token = auth0.authorize_access_token()["id_token"]
-    resp = auth0.get('userinfo')
-    userinfo = resp.json()
+    claims = id_token_claims(id_token)
+    userinfo = get_userinfo(claims)
 
     # store user id in datastore for later retrieval
-    # check if already in system first
-    query = client.query(kind=USERS)
-    results = list(query.fetch())
-    for r in results:
-        if r["user_id"] == userinfo["sub"]:
-            user_flag = True
-    if not user_flag:
-        new_user = datastore.entity.Entity(key=client.key(USERS))
-        new_user.update({"user_id": userinfo["sub"], "name": userinfo["name"]})
-        client.put(new_user)
-
-    # Store the user information in flask session.
+    save_user(userinfo)
+
+    # Store the user information in flask session, under a new session id.
+    session.regenerate()
     session['jwt_payload'] = userinfo
     session['profile'] = {
         'user_id': userinfo['sub'],
@@ -110,12 +179,62 @@ def logout():
     return redirect(auth0.api_base_url + '/v2/logout?' + urlencode(params))
 
 
-# retrieve list of all users
+# retrieve list of all users, a page at a time.
+# ?limit= sets the page size and the "next" link carries an opaque cursor,
+# ?export=true streams every user as one json array instead.
 @app.route('/users', methods=['GET'])
 def users_get():
-    query = client.query(kind=USERS)
-    results = list(query.fetch())
-    return json.dumps(results), 200
+    if request.args.get('export') == 'true':
+        return Response(stream_with_context(export_users()), mimetype='application/json')
+    try:
+        q_limit = int(request.args.get('limit', USERS_PAGE_LIMIT))
+    except ValueError:
+        return jsonify({"Error": "limit must be a number"}), 400
+    if q_limit < 1 or q_limit > USERS_MAX_LIMIT:
+        return jsonify({"Error": "limit must be between 1 and " + str(USERS_MAX_LIMIT)}), 400
+    query = client.query(kind=USERS, projection=USER_FIELDS)
+    u_iterator = query.fetch(limit=q_limit, start_cursor=request.args.get('cursor'))
+    try:
+        results = [dict(u) for u in next(u_iterator.pages)]
+    except (api_exceptions.BadRequest, ValueError):
+        return jsonify({"Error": "Invalid cursor."}), 400
+    output = {"users": results}
+    if pagination.has_more(u_iterator, len(results), q_limit):
+        output["next"] = request.base_url + "?" + urlencode(
+            {"limit": q_limit, "cursor": u_iterator.next_page_token.decode('ascii')})
+    return jsonify(output), 200
+
+
+# yields the whole user list as a json array, one datastore page at a time,
+# so memory stays flat no matter how many users there are
+def export_users():
+    query = client.query(kind=USERS, projection=USER_FIELDS)
+    cursor = None
+    first = True
+    yield '['
+    while True:
+        u_iterator = query.fetch(limit=USERS_MAX_LIMIT, start_cursor=cursor)
+        page = list(next(u_iterator.pages))
+        if page:
+            chunk = ",".join(json.dumps(dict(u)) for u in page)
+            yield chunk if first else "," + chunk
+            first = False
+        if not pagination.has_more(u_iterator, len(page), USERS_MAX_LIMIT):
+            break
+        cursor = u_iterator.next_page_token
+    yield ']'
+
+
+# state of the auth0 circuit breakers, bulkheads and auth caches
+@app.route('/status', methods=['GET'])
+def status():
+    output = http_client.status()
+    output["jwks"] = jwt_functions.jwks_cache.status()
+    output["verified_tokens"] = jwt_functions.verified_tokens.stats()
+    output["rejected_tokens"] = jwt_functions.rejected_tokens.stats()
+    output["auth_failures"] = auth.auth_failures.stats()
+    output["user_writes"] = user_writes.stats()
+    return jsonify(output), 200
 
 
 if __name__ == '__main__':
@@ -0,0 +1,30 @@
+# json merge patch (rfc 7386) for the flat entities PATCH edits.
+# the patch has to be an object naming only fields in the endpoint's allow-list.
+# a member replaces the stored value, null would remove it, which the required
+# fields don't allow. the entity is changed in memory only; apply reports
+# whether anything actually changed so an unchanged entity isn't written again.
+
+
+class PatchError(ValueError):
+    pass
+
+
+def apply(entity, patch, allowed, required=()):
+    if not isinstance(patch, dict):
+        raise PatchError("The request body must be a JSON object")
+    unknown = [name for name in patch if name not in allowed]
+    if unknown:
+        raise PatchError("These attributes can't be changed: " + ", ".join(sorted(unknown)))
+    changed = False
+    for name in sorted(patch):
+        value = patch[name]
+        if value is None:
+            if name in required:
+                raise PatchError(name + " can't be removed")
+            if name in entity:
+                del entity[name]
+                changed = True
+        elif name not in entity or entity[name] != value or type(entity[name]) is not type(value):
+            entity[name] = value
+            changed = True
+    return changed
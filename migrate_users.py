@@ -0,0 +1,44 @@
+# one-off migration: re-key USERS entities by their auth0 sub.
+# older rows were stored under auto-allocated ids and looked up by scanning every
+# user; main.save_user now expects the key name to be the sub. each batch writes
+# the sub-keyed copies and deletes the old rows; rows that are already keyed by
+# sub are left alone, and duplicates of the same sub collapse into one entity.
+#   python migrate_users.py [--dry-run]
+import sys
+from google.cloud import datastore
+
+USERS = 'USERS'
+BATCH_SIZE = 500
+
+
+def migrate(client, dry_run=False):
+    query = client.query(kind=USERS)
+    cursor = None
+    moved = 0
+    while True:
+        iterator = query.fetch(limit=BATCH_SIZE, start_cursor=cursor)
+        page = list(next(iterator.pages))
+        new_users = {}
+        old_keys = []
+        for user in page:
+            if user.key.name is not None or "user_id" not in user:
+                continue
+            new_user = datastore.entity.Entity(key=client.key(USERS, user["user_id"]))
+            new_user.update(user)
+            new_users[user["user_id"]] = new_user
+            old_keys.append(user.key)
+        if new_users and not dry_run:
+            # keep whatever is already stored under the new key
+            existing = set(e.key.name for e in client.get_multi([u.key for u in new_users.values()]))
+            client.put_multi([u for sub, u in new_users.items() if sub not in existing])
+            client.delete_multi(old_keys)
+        moved += len(old_keys)
+        print("re-keyed %d users" % moved)
+        cursor = iterator.next_page_token
+        if not cursor:
+            break
+    return moved
+
+
+if __name__ == '__main__':
+    migrate(datastore.Client(), dry_run='--dry-run' in sys.argv)
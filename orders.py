@@ -1,31 +1,55 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
+from google.api_core import exceptions
 from google.cloud import datastore
-import jwt_functions
+from six.moves.urllib.parse import urlencode
+import json
+import logging
+import auth
+import batches
+import constants
+import counters
+import links
+import merge_patch
+import pagination
+import query_params
+import transactions
 
 client = datastore.Client()
+logger = logging.getLogger(__name__)
 
 bp = Blueprint('orders', __name__, url_prefix='/orders')
+auth.require_auth(bp)
 ORDERS = "orders"
+# what PATCH may change, all of them required
+ORDER_FIELDS = ("has_shipped", "date", "location")
 ITEMS = "items"
 
 
-# function to check for json request and authorization
-def check_auth_accept(header):
-    if (header['Accept'] != 'application/json') and (header['Accept'] != '*/*'):
-        return jsonify({"Error": "Please make sure the accept is json."}), 406
-    # if missing/invalid JWT return 401
-    if 'Authorization' not in header:
-        return jsonify({"Error": "Missing auth credentials."}), 401
-    return None
+# properties of an order from a request body, KeyError when one is missing
+def order_properties(content, owner_id):
+    return {"has_shipped": content["has_shipped"], "date": content["date"],
+            "location": content["location"], "owner_id": owner_id}
 
 
 # function to update an order entity
-def update_order(entity, content, owner_id):
-    entity.update({"has_shipped": content["has_shipped"],
-                   "date": content["date"], "location": content["location"], "owner_id": owner_id})
-    client.put(entity)
-    result = client.get(entity.key)
-    # set id and self
+def update_order(entity, content, owner_id, created=False):
+    entity.update(order_properties(content, owner_id))
+    if created:
+        # the new entity and the owner's count are written together
+        def create():
+            client.put(entity)
+            counters.increment(client, ORDERS, owner_id, 1)
+        transactions.run_in_transaction(client, create)
+    else:
+        # replacing: the caller read the entity in the transaction this runs in
+        client.put(entity)
+    return entity
+
+
+# response body for an order that was just written
+def order_result(entity):
+    # the put completed the key, the rest is what was just written
+    result = client.get(entity.key) if constants.VERIFY_WRITES else dict(entity)
     result["id"] = entity.key.id
     result["self"] = request.url_root + 'orders/' + str(entity.key.id)
     return result
@@ -34,56 +58,83 @@ def update_order(entity, content, owner_id):
 # create an order or get a list of all orders
 @bp.route('', methods=['POST'])
 def orders_post():
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     owner_id = payload["sub"]
     # creates an order for the user
     try:
         content = request.get_json()
         new_item = datastore.entity.Entity(key=client.key(ORDERS))
-        result = update_order(new_item, content, owner_id)
+        result = order_result(update_order(new_item, content, owner_id, created=True))
         return jsonify(result), 201
     except KeyError:
         return jsonify({"Error": "The request object is missing at least one of the required attributes"}), 400
 
 
+# create many orders at once from a JSON array of bodies. every body is checked
+# before anything is written, and the answer has a result per body in the same
+# order: 201 when all of them were created, 207 when some weren't.
+def orders_post_batch():
+    payload = g.payload
+    owner_id = payload["sub"]
+    bodies = request.get_json(silent=True)
+    if not isinstance(bodies, list) or not 0 < len(bodies) <= constants.CREATE_BATCH_MAX:
+        return jsonify({"Error": "The request body must be an array of 1 to "
+                        + str(constants.CREATE_BATCH_MAX) + " orders"}), 400
+    results = [None] * len(bodies)
+    valid = []
+    for i, content in enumerate(bodies):
+        try:
+            valid.append((i, order_properties(content, owner_id)))
+        except (KeyError, TypeError):
+            results[i] = {"status": 400,
+                          "Error": "The request object is missing at least one of the required attributes"}
+    entities, errors = batches.create_multi(client, ORDERS, owner_id, [props for i, props in valid])
+    for (i, props), entity, error in zip(valid, entities, errors):
+        if error:
+            results[i] = {"status": 503, "Error": error}
+        else:
+            result = dict(entity)
+            result["id"] = entity.key.id
+            result["self"] = request.url_root + 'orders/' + str(entity.key.id)
+            results[i] = {"status": 201, "order": result}
+    status = 201 if all(result["status"] == 201 for result in results) else 207
+    return jsonify({"results": results}), status
+
+
+# POST /orders:batch, :bulk-ship and :bulk-delete aren't under the blueprint's
+# /orders/ prefix, so they are added to the app directly, under the blueprint's
+# endpoint names so auth still applies
+@bp.record
+def add_batch_route(state):
+    for suffix, view in ((':batch', orders_post_batch), (':bulk-ship', orders_bulk_ship),
+                         (':bulk-delete', orders_bulk_delete)):
+        state.app.add_url_rule(state.url_prefix + suffix, bp.name + '.' + view.__name__,
+                               view, methods=['POST'])
+
+
 @bp.route('', methods=['GET'])
 def orders_get():
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     query = client.query(kind=ORDERS)
-    # NEED TO TEST THIS FILTER
     query.add_filter("owner_id", "=", payload["sub"])
-    order_total = len(list(query.fetch()))
-    q_limit = int(request.args.get('limit', '5'))
-    q_offset = int(request.args.get('offset', '0'))
-    l_iterator = query.fetch(limit=q_limit, offset=q_offset)
-    pages = l_iterator.pages
-    results = list(next(pages))
-    if l_iterator.next_page_token:
-        next_offset = q_offset + q_limit
-        next_url = request.base_url + "?limit=" + str(q_limit) + "&offset=" + str(next_offset)
-    else:
-        next_url = None
+    try:
+        page = pagination.PageRequest(ORDERS, payload["sub"], request.args, query_params.ORDERS)
+        results, next_url = page.fetch(query)
+    except pagination.BadPage as e:
+        return jsonify({"Error": str(e)}), 400
     for e in results:
         e["id"] = e.key.id
         e["self"] = request.url_root + 'orders/' + str(e.key.id)
-        e["total_orders"] = order_total
-    output = {"orders": results}
+    fields = page.params.get("fields")
+    output = {"orders": [query_params.select(e, fields) for e in results],
+              "total_orders": counters.total(client, ORDERS, payload["sub"])}
     if next_url:
         output["next"] = next_url
     return jsonify(output), 200
 
 
 @bp.route('', methods=['PUT', 'DELETE'])
+@auth.public
 def orders_invalid():
     return jsonify({"Error": "These operations are not allowed on the entire list."}), 405
 
@@ -91,12 +142,11 @@ def orders_invalid():
 # grab a specific order or delete that specific order
 @bp.route('/<id>', methods=['GET'])
 def orders_get_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
+    try:
+        fields = query_params.ORDERS.parse_fields(request.args)
+    except query_params.BadQuery as e:
+        return jsonify({"Error": str(e)}), 400
     order_key = client.key(ORDERS, int(id))
     order = client.get(key=order_key)
     if not order:
@@ -105,28 +155,36 @@ def orders_get_specific(id):
         return jsonify({"Error": "You are unauthorized to view this."}), 403
     order["id"] = order.key.id
     order["self"] = request.url_root + 'orders/' + str(order.key.id)
-    return jsonify(order), 200
+    return jsonify(query_params.select(order, fields)), 200
 
 
 @bp.route('/<id>', methods=['PATCH'])
 def orders_patch_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
-    content = request.get_json()
+    payload = g.payload
+    content = request.get_json(force=True, silent=True)
     order_key = client.key(ORDERS, int(id))
-    order = client.get(key=order_key)
-    if not order:
-        return jsonify({"Error": "No order with this order_id exists"}), 404
-    if order["owner_id"] != payload["sub"]:
-        return jsonify({"Error": "You are unauthorized to view this."}), 403
-    for key in content:
-        if order[key]:
-            order[key] = content[key]
+
+    # the patch is applied to a plain read first, so one that changes nothing
+    # costs a single lookup. a real change is re-read, re-applied and written
+    # once in a transaction, so a concurrent attach/detach isn't undone
+    def patch(write):
+        order = client.get(key=order_key)
+        if not order:
+            return None, False, (jsonify({"Error": "No order with this order_id exists"}), 404)
+        if order["owner_id"] != payload["sub"]:
+            return None, False, (jsonify({"Error": "You are unauthorized to view this."}), 403)
+        try:
+            changed = merge_patch.apply(order, content, ORDER_FIELDS, required=ORDER_FIELDS)
+        except merge_patch.PatchError as e:
+            return None, False, (jsonify({"Error": str(e)}), 400)
+        if changed and write:
             client.put(order)
+        return order, changed, None
+    order, changed, error = patch(False)
+    if changed:
+        order, changed, error = transactions.run_in_transaction(client, lambda: patch(True))
+    if error:
+        return error
     order["id"] = order.key.id
     order["self"] = request.url_root + 'orders/' + str(order.key.id)
     return jsonify(order), 200
@@ -134,150 +192,305 @@ def orders_patch_specific(id):
 
 @bp.route('/<id>', methods=['PUT'])
 def orders_put_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
-    try:
-        content = request.get_json()
-        order_key = client.key(ORDERS, int(id))
+    payload = g.payload
+    content = request.get_json()
+    order_key = client.key(ORDERS, int(id))
+
+    # read and replace in one transaction, so a concurrent attach/detach isn't undone
+    def replace():
         order = client.get(key=order_key)
         if not order:
-            return jsonify({"Error": "No order with this order_id exists"}), 404
+            return None, (jsonify({"Error": "No order with this order_id exists"}), 404)
         if order["owner_id"] != payload["sub"]:
-            return jsonify({"Error": "You are unauthorized to view this."}), 403
-        owner_id = payload["sub"]
-        result = update_order(order, content, owner_id)
-        return jsonify(result), 200
+            return None, (jsonify({"Error": "You are unauthorized to view this."}), 403)
+        return update_order(order, content, payload["sub"]), None
+    try:
+        order, error = transactions.run_in_transaction(client, replace)
     except KeyError:
         return jsonify({"Error": "The request object is missing at least one of the required attributes"}), 400
+    if error:
+        return error
+    return jsonify(order_result(order)), 200
 
 
 @bp.route('/<id>', methods=['DELETE'])
 def orders_delete_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     order_key = client.key(ORDERS, int(id))
     order = client.get(key=order_key)
     if not order:
         return jsonify({"Error": "No order with this order_id exists"}), 404
     if order["owner_id"] != payload["sub"]:
         return jsonify({"Error": "You are unauthorized to view this."}), 403
-    # check if order has a item
-    if 'items' in order.keys() and order['items'] is not None:
-        for i in range(len(order['items'])):
-            item_key = client.key(ITEMS, order['items'][i]['id'])
-            item = client.get(key=item_key)
-            # update item to not have that order
-            i = 0
-            length = len(item['orders'])
-            while i < length:
-                if order.key.id == item['orders'][i]['id']:
-                    item['orders'].pop(i)
-                    length = len(item['orders'])
-                    client.put(item)
-                else:
-                    i += 1
-    client.delete(order_key)
+    delete_order(order, payload["sub"])
     return jsonify(''), 204
 
 
-# put an item in an order or delete an item from an order
+# delete an order already checked to be owner_id's and take it off its items.
+# the items are unlinked a batch at a time, the last batch in the transaction
+# that deletes the order (a commit takes DATASTORE_BATCH_SIZE writes, two of
+# them are the order delete and the counter shard)
+def delete_order(order, owner_id):
+    item_keys = [client.key(ITEMS, item_id) for item_id in links.item_ids(order)]
+    chunks = list(batches.chunks(item_keys, constants.DATASTORE_BATCH_SIZE - 2)) or [[]]
+    for chunk in chunks[:-1]:
+        transactions.run_in_transaction(
+            client, lambda: unlink_items(batches.get_multi(client, chunk), order.key.id))
+    return delete_orders([order], owner_id, done=set(key.id for chunk in chunks[:-1] for key in chunk))
+
+
+# delete orders already checked to be owner_id's and take them off their items
+# (except those in done) in one transaction. only orders that weren't deleted
+# concurrently are counted, returns how many that was
+def delete_orders(order_list, owner_id, done=()):
+    order_keys = [order.key for order in order_list]
+    item_ids = [item_id for order in order_list for item_id in links.item_ids(order) if item_id not in done]
+    item_keys = [client.key(ITEMS, item_id) for item_id in sorted(set(item_ids))]
+
+    def delete():
+        entities = batches.get_multi(client, order_keys + item_keys)
+        current = [order for order in entities[:len(order_keys)] if order is not None]
+        if not current:
+            return 0
+        items = entities[len(order_keys):]
+        # items attached since the orders were first read
+        known = set(item_ids) | set(done)
+        added = [client.key(ITEMS, item_id) for order in current for item_id in links.item_ids(order)
+                 if item_id not in known]
+        if added:
+            items += batches.get_multi(client, added)
+        # one write per item, even one (wrongly) linked to several of the orders
+        changed = {}
+        for item in items:
+            for order in current:
+                if item is not None and links.unlink_order(item, order.key.id):
+                    changed[item.key.id] = item
+        if changed:
+            client.put_multi(list(changed.values()))
+        client.delete_multi([order.key for order in current])
+        counters.increment(client, ORDERS, owner_id, -len(current))
+        return len(current)
+    return transactions.run_in_transaction(client, delete)
+
+
+# take the order off these items (None for deleted ones) with one put_multi,
+# inside the caller's transaction
+def unlink_items(items, order_id):
+    changed = [item for item in items if item is not None and links.unlink_order(item, order_id)]
+    if changed:
+        client.put_multi(changed)
+
+
+# put an item in an order or delete an item from an order. the order and the
+# item are read with one get_multi and written with one put_multi inside a
+# transaction, so concurrent attaches to the same order retry instead of
+# overwriting each other's item list.
 @bp.route('/<oid>/items/<iid>', methods=['PUT'])
 def put_items_on_order(oid, iid):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     order_key = client.key(ORDERS, int(oid))
-    order = client.get(key=order_key)
     item_key = client.key(ITEMS, int(iid))
-    item = client.get(key=item_key)
-    if not item or not order:
-        return jsonify({"Error": "No order and/or item exists with this id."}), 404
-    if order["owner_id"] != payload["sub"]:
-        return jsonify({"Error": "You are unauthorized to view this."}), 403
-    # check if item is already assigned to this order
-    if 'items' in order.keys():
-        for i in range(len(order['items'])):
-            if item.key.id == order['items'][i]['id']:
-                return jsonify({"Error": "This item is already on this order."}), 403
-    # otherwise, assign the item to the order
-    if 'items' in order.keys():
-        order['items'].append({"id": item.key.id, "self": request.url_root + 'items/' + str(item.key.id)})
-    else:
-        order['items'] = [{"id": item.key.id, "self": request.url_root + 'items/' + str(item.key.id)}]
-    client.put(order)
-    item['orders'] = {"id": order.key.id, "self": request.url_root + 'orders/' + str(order.key.id)}
-    client.put(item)
-    return jsonify(''), 204
+
+    def attach():
+        order, item = batches.get_multi(client, [order_key, item_key])
+        if not item or not order:
+            return jsonify({"Error": "No order and/or item exists with this id."}), 404
+        if order["owner_id"] != payload["sub"]:
+            return jsonify({"Error": "You are unauthorized to view this."}), 403
+        # check if item is already assigned to this order
+        if item.key.id in links.item_ids(order):
+            return jsonify({"Error": "This item is already on this order."}), 403
+        # otherwise, assign the item to the order
+        order['items'] = (order.get('items') or []) + [
+            {"id": item.key.id, "self": request.url_root + 'items/' + str(item.key.id)}]
+        item['orders'] = {"id": order.key.id, "self": request.url_root + 'orders/' + str(order.key.id)}
+        client.put_multi([order, item])
+        return jsonify(''), 204
+    return transactions.run_in_transaction(client, attach)
 
 
 @bp.route('/<oid>/items/<iid>', methods=['DELETE'])
 def delete_items_on_order(oid, iid):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     order_key = client.key(ORDERS, int(oid))
-    order = client.get(key=order_key)
     item_key = client.key(ITEMS, int(iid))
-    item = client.get(key=item_key)
-    if not item or not order:
-        return jsonify({"Error": "No order and/or item exists with this id."}), 404
-    if order["owner_id"] != payload["sub"]:
-        return jsonify({"Error": "You are unauthorized to view this."}), 403
-    # check if item is actually on this order
-    if 'items' in order.keys() and order['items'] is not None:
-        i = 0
-        length = len(order['items'])
-        while i < length:
-            if item.key.id == order['items'][i]['id']:
-                order['items'].pop(i)
-                length = len(order['items'])
-                client.put(order)
-                item['orders'] = None
-                client.put(item)
-                return '', 204
-            else:
-                i += 1
-    return jsonify({"Error": "The item is not on this order."}), 404
-
-
-# get all items for a given order
+
+    def detach():
+        order, item = batches.get_multi(client, [order_key, item_key])
+        if not item or not order:
+            return jsonify({"Error": "No order and/or item exists with this id."}), 404
+        if order["owner_id"] != payload["sub"]:
+            return jsonify({"Error": "You are unauthorized to view this."}), 403
+        # check if item is actually on this order
+        if not links.unlink_item(order, item.key.id):
+            return jsonify({"Error": "The item is not on this order."}), 404
+        links.unlink_order(item, order.key.id)
+        client.put_multi([order, item])
+        return '', 204
+    return transactions.run_in_transaction(client, detach)
+
+
+# get all items for a given order, a page at a time (Link: <...>; rel="next")
 @bp.route('/<id>/items', methods=['GET'])
 def items_get_specific(id):
-    flag = check_auth_accept(request.headers)
-    if flag:
-        return flag
-    payload = jwt_functions.verify_jwt(request)
-    if not payload:
-        return jsonify({"Error": "Unauthorized."}), 401
+    payload = g.payload
     order_key = client.key(ORDERS, int(id))
     order = client.get(key=order_key)
     if not order:
         return jsonify({"Error": "No order exists with this id."}), 404
     if order["owner_id"] != payload["sub"]:
         return jsonify({"Error": "You are unauthorized to view this."}), 403
+    if 'items' not in order.keys() or not order['items']:
+        return jsonify([]), 204
+    # the cursor is a position in the order's item list
+    page_kind = ORDERS + "/" + str(order.key.id) + "/items"
+    try:
+        limit = pagination.int_arg(request.args, 'limit', constants.PAGE_MAX_LIMIT, 1, constants.PAGE_MAX_LIMIT)
+        start = 0
+        if request.args.get('cursor'):
+            start = pagination.decode_cursor(request.args['cursor'], page_kind, payload["sub"])[1]
+    except pagination.BadPage as e:
+        return jsonify({"Error": str(e)}), 400
+    page_links = order['items'][start:start + limit]
+    # items deleted without being unlinked are left out
     item_list = []
-    if 'items' in order.keys() and order['items'] is not None:
-        for i in range(len(order['items'])):
-            item_key = client.key(ITEMS, order['items'][i]['id'])
-            item = client.get(key=item_key)
+    for item in batches.get_multi(client, [client.key(ITEMS, link['id']) for link in page_links]):
+        if item is not None:
             item["id"] = item.key.id
             item["self"] = request.url_root + 'items/' + str(item.key.id)
-            item_list.append(item_key)
-            client.put(item)
-        return jsonify(client.get_multi(item_list)), 200
-    else:
-        return jsonify([]), 204
+            item_list.append(item)
+    response = jsonify(item_list)
+    if start + limit < len(order['items']):
+        token = pagination.encode_cursor(page_kind, payload["sub"], {}, start + limit)
+        next_url = request.base_url + "?" + urlencode({"limit": limit, "cursor": token})
+        response.headers['Link'] = '<' + next_url + '>; rel="next"'
+    return response, 200
+
+
+# ship or delete many orders in one request, named by a JSON body
+# {"ids": [...]} or by filters in the query string (the ones GET /orders takes):
+#   POST /orders:bulk-ship?location=Portland&has_shipped=false
+#   POST /orders:bulk-delete   {"ids": [1, 2, 3]}
+# the orders are handled DATASTORE_BATCH_SIZE at a time and the answer is
+# streamed as a JSON array with a progress line per batch (including the ids
+# that were missing or someone else's) and a summary at the end.
+def orders_bulk_ship():
+    return bulk_response(ship_orders, "shipped")
+
+
+def orders_bulk_delete():
+    return bulk_response(delete_selected, "deleted")
+
+
+def bulk_response(process, done_name):
+    owner_id = g.payload["sub"]
+    try:
+        selection = bulk_selection(owner_id)
+    except query_params.BadQuery as e:
+        return jsonify({"Error": str(e)}), 400
+    return Response(stream_with_context(bulk_progress(selection, process, done_name, owner_id)),
+                    mimetype='application/json')
+
+
+# chunks of order keys: the ids in the body, or every order of the owner that
+# matches the query string filters, read keys-only a page at a time
+def bulk_selection(owner_id):
+    body = request.get_json(silent=True)
+    ids = body.get("ids") if isinstance(body, dict) else None
+    params = query_params.ORDERS.parse(request.args)
+    if ids is not None and params["filters"]:
+        raise query_params.BadQuery("Give either ids or filters, not both")
+    if ids is None:
+        if not params["filters"]:
+            raise query_params.BadQuery("Give the ids of the orders or at least one filter")
+        return selected_keys(owner_id, params["filters"])
+    if not isinstance(ids, list) or not 0 < len(ids) <= constants.BULK_MAX_IDS:
+        raise query_params.BadQuery("ids must be an array of 1 to " + str(constants.BULK_MAX_IDS) + " order ids")
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise query_params.BadQuery("ids must be numbers")
+    unique = list(dict.fromkeys(ids))
+    return batches.chunks([client.key(ORDERS, i) for i in unique])
+
+
+def selected_keys(owner_id, filters):
+    query = client.query(kind=ORDERS)
+    query.add_filter("owner_id", "=", owner_id)
+    query_params.apply(query, {"filters": filters})
+    query.keys_only()
+    cursor = None
+    while True:
+        iterator = query.fetch(limit=constants.DATASTORE_BATCH_SIZE, start_cursor=cursor)
+        keys = [entity.key for entity in next(iterator.pages)]
+        if keys:
+            yield keys
+        if not pagination.has_more(iterator, len(keys), constants.DATASTORE_BATCH_SIZE):
+            return
+        cursor = iterator.next_page_token
+
+
+def bulk_progress(selection, process, done_name, owner_id):
+    processed = done = 0
+    yield '['
+    try:
+        for keys in selection:
+            count, errors = process(keys, owner_id)
+            processed += len(keys)
+            done += count
+            yield json.dumps({"processed": processed, done_name: done, "errors": errors}) + ","
+        yield json.dumps({"processed": processed, done_name: done, "complete": True})
+    except exceptions.GoogleAPIError:
+        logger.exception("Bulk %s stopped after %d orders", done_name, processed)
+        yield json.dumps({"processed": processed, done_name: done, "complete": False,
+                          "Error": "Stopped early, the rest of the orders were not changed."})
+    yield ']'
+
+
+# the owner's orders among these keys, and an error for each one that isn't
+def owned_orders(keys, orders_read, owner_id):
+    owned = []
+    errors = []
+    for key, order in zip(keys, orders_read):
+        if order is None:
+            errors.append({"id": key.id, "status": 404})
+        elif order["owner_id"] != owner_id:
+            errors.append({"id": key.id, "status": 403})
+        else:
+            owned.append(order)
+    return owned, errors
+
+
+# mark a batch of orders shipped with one get_multi and one put_multi in a
+# transaction; orders already shipped aren't written again
+def ship_orders(keys, owner_id):
+    def ship():
+        owned, errors = owned_orders(keys, batches.get_multi(client, keys), owner_id)
+        changed = [order for order in owned if order.get("has_shipped") is not True]
+        for order in changed:
+            order["has_shipped"] = True
+        if changed:
+            client.put_multi(changed)
+        return len(owned), errors
+    return transactions.run_in_transaction(client, ship)
+
+
+# delete a batch of orders: as many per transaction as fit in one commit with
+# the items they unlink, orders with too many items for that on their own
+def delete_selected(keys, owner_id):
+    owned, errors = owned_orders(keys, batches.get_multi(client, keys), owner_id)
+    deleted = 0
+    group = []
+    writes = 1
+    for order in owned:
+        size = 1 + len(links.item_ids(order))
+        if size + 1 > constants.DATASTORE_BATCH_SIZE:
+            deleted += delete_order(order, owner_id)
+            continue
+        if writes + size > constants.DATASTORE_BATCH_SIZE:
+            deleted += delete_orders(group, owner_id)
+            group = []
+            writes = 1
+        group.append(order)
+        writes += size
+    if group:
+        deleted += delete_orders(group, owner_id)
+    return deleted, errors
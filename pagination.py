@@ -0,0 +1,106 @@
+from flask import current_app, request
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud.datastore.query import Iterator
+from itsdangerous import BadSignature, URLSafeSerializer
+from six.moves.urllib.parse import urlencode
+import constants
+import query_params
+
+# keyset pagination for the list endpoints.
+# the "next" link carries an opaque cursor: the owner, the query parameters and
+# the datastore end cursor, signed with the app secret so it can't be edited or
+# replayed against another owner. following it resumes the query right where the
+# last page ended instead of skipping (and paying for) every earlier row.
+# ?offset= still works for old links, up to PAGE_MAX_OFFSET.
+
+
+class BadPage(ValueError):
+    pass
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.secret_key, salt='list-cursor')
+
+
+def encode_cursor(kind, owner_id, params, end_cursor):
+    return _serializer().dumps({"k": kind, "o": owner_id, "p": params, "c": end_cursor})
+
+
+def decode_cursor(token, kind, owner_id):
+    try:
+        data = _serializer().loads(token)
+    except BadSignature:
+        raise BadPage("Invalid cursor.")
+    if data.get("k") != kind or data.get("o") != owner_id:
+        raise BadPage("Invalid cursor.")
+    return data["p"], data["c"]
+
+
+def int_arg(args, name, default, minimum, maximum):
+    value = args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise BadPage(name + " must be a number")
+    if value < minimum or value > maximum:
+        raise BadPage(name + " must be between " + str(minimum) + " and " + str(maximum))
+    return value
+
+
+# the datastore iterator keeps a batch's more_results state only in this private
+# attribute. check it is still there when the module loads, so a client upgrade
+# that renames it fails here instead of quietly cutting listings short again
+MORE_RESULTS = '_more_results'
+if not hasattr(Iterator(None, None), MORE_RESULTS):
+    raise ImportError("google.cloud.datastore.query.Iterator has no " + MORE_RESULTS +
+                      ", pagination.has_more needs updating for this client version")
+
+
+# whether the query has rows after the batch the iterator just returned. only
+# NO_MORE_RESULTS leaves next_page_token unset. a batch datastore cut short
+# (NOT_FINISHED: size or time limit) can hold fewer than limit rows and still
+# have more after it, so the page length alone can't tell.
+def has_more(iterator, count, limit):
+    if iterator.next_page_token is None:
+        return False
+    return getattr(iterator, MORE_RESULTS) or count >= limit
+
+
+# one page of a list request. params are the filters and sort the page was
+# asked for (checked against spec, a query_params.ListSpec), restored from the
+# cursor when there is one.
+class PageRequest(object):
+    def __init__(self, kind, owner_id, args, spec=None):
+        self.kind = kind
+        self.owner_id = owner_id
+        self.limit = int_arg(args, 'limit', constants.PAGE_DEFAULT_LIMIT, 1, constants.PAGE_MAX_LIMIT)
+        self.offset = 0
+        self.start_cursor = None
+        token = args.get('cursor')
+        if token:
+            self.params, self.start_cursor = decode_cursor(token, kind, owner_id)
+        else:
+            try:
+                self.params = spec.parse(args) if spec is not None else {}
+            except query_params.BadQuery as e:
+                raise BadPage(str(e))
+            self.offset = int_arg(args, 'offset', 0, 0, constants.PAGE_MAX_OFFSET)
+
+    # run the query for this page, returns the entities and the next link (or None)
+    def fetch(self, query):
+        if self.params:
+            query_params.apply(query, self.params)
+        iterator = query.fetch(limit=self.limit, offset=self.offset, start_cursor=self.start_cursor)
+        try:
+            results = list(next(iterator.pages))
+        except FailedPrecondition:
+            # no index for it (index.yaml not deployed yet), datastore won't scan
+            raise BadPage("This combination of filters and sort is not supported.")
+        next_url = None
+        if has_more(iterator, len(results), self.limit):
+            token = encode_cursor(self.kind, self.owner_id, self.params,
+                                  iterator.next_page_token.decode('ascii'))
+            next_url = request.base_url + "?" + urlencode({"limit": self.limit, "cursor": token})
+        return results, next_url
@@ -0,0 +1,206 @@
+import itertools
+
+# server-side filtering and sorting for the list endpoints.
+#
+#   GET /orders?has_shipped=false&date>=2021-06-01&sort=-date
+#   GET /items?quantity[gt]=3&sort=quantity
+#
+# every property and operator has to be on the endpoint's allow-list, and the
+# combination has to be one datastore can answer from an index: at most one
+# property with an inequality, and when sorting with an inequality the sort has
+# to be on that same property. anything else is a 400, never a scan.
+#
+#   GET /orders?fields=date,location
+#
+# picks the properties returned. when only scalar properties are asked for and
+# nothing is filtered or sorted, the list is a projection query answered from an
+# index alone (keys-only for just id/self); otherwise the entities are trimmed
+# before they are serialized. generate_indexes.py writes index.yaml from the
+# same rules.
+
+EQUALITY = "="
+INEQUALITIES = (">=", "<=", ">", "<")
+# ?date[gte]=... spelling, for clients that can't send a bare date>=...
+BRACKET_OPS = {"gte": ">=", "lte": "<=", "gt": ">", "lt": "<", "eq": "="}
+# arguments that are not filters
+RESERVED = ("limit", "offset", "cursor", "sort", "fields")
+# always there, they are built from the key
+KEY_FIELDS = ("id", "self")
+
+
+class BadQuery(ValueError):
+    pass
+
+
+def to_bool(value):
+    if value in ("true", "false"):
+        return value == "true"
+    raise ValueError(value)
+
+
+TYPES = {"bool": to_bool, "int": int, "str": str}
+
+
+# what one list endpoint accepts. filters maps a property to its type and the
+# operators it allows, sorts lists the properties it can be sorted by, fields
+# the properties that can be asked for and projectable the scalar, indexed ones
+# among them that a projection query can return.
+class ListSpec(object):
+    def __init__(self, kind, filters, sorts, fields, projectable):
+        self.kind = kind
+        self.filters = filters
+        self.sorts = sorts
+        self.fields = fields
+        self.projectable = projectable
+
+    # ?fields=a,b as a sorted list, or None for every property
+    def parse_fields(self, args):
+        value = args.get("fields")
+        if value is None:
+            return None
+        fields = set(f.strip() for f in value.split(",") if f.strip())
+        if not fields:
+            raise BadQuery("fields can't be empty")
+        unknown = fields - set(self.fields) - set(KEY_FIELDS)
+        if unknown:
+            raise BadQuery("Unknown field: " + sorted(unknown)[0])
+        return sorted(fields)
+
+    # properties for a projection query, ["__key__"] for keys-only, or None
+    # when the whole entity has to be read
+    def projection(self, params):
+        fields = params.get("fields")
+        if fields is None or params["filters"] or params.get("sort"):
+            return None
+        props = [f for f in fields if f not in KEY_FIELDS]
+        if not props:
+            return ["__key__"]
+        if set(props) <= set(self.projectable):
+            return props
+        return None
+
+    # turn request args into {"filters": [[prop, op, value], ...], "sort": "-date",
+    # "fields": [...], "projection": [...]}
+    def parse(self, args):
+        filters = []
+        for name in args:
+            if name in RESERVED:
+                continue
+            prop, op = split_arg(name)
+            if prop not in self.filters:
+                raise BadQuery("Unknown filter: " + prop)
+            prop_type, ops = self.filters[prop]
+            if op not in ops:
+                raise BadQuery("Operator " + op + " is not allowed on " + prop)
+            for value in args.getlist(name):
+                try:
+                    filters.append([prop, op, TYPES[prop_type](value)])
+                except ValueError:
+                    raise BadQuery("Invalid value for " + prop + ": " + value)
+        sort = args.get("sort") or None
+        if sort is not None and sort.lstrip("-") not in self.sorts:
+            raise BadQuery("Unable to sort by " + sort.lstrip("-"))
+        params = {"filters": sorted(filters, key=lambda f: (f[0], f[1])), "sort": sort,
+                  "fields": self.parse_fields(args)}
+        self.index(params)
+        params["projection"] = self.projection(params)
+        return params
+
+    # properties (with direction) of the composite index the query needs after
+    # owner_id, or raises BadQuery when datastore couldn't run it
+    def index(self, params):
+        equality = sorted(set(f[0] for f in params["filters"] if f[1] == EQUALITY))
+        inequality = set(f[0] for f in params["filters"] if f[1] != EQUALITY)
+        if len(inequality) > 1:
+            raise BadQuery("Only one property can be filtered with a range")
+        sort = params.get("sort")
+        if inequality:
+            prop = inequality.pop()
+            if sort is not None and sort.lstrip("-") != prop:
+                raise BadQuery("When filtering " + prop + " with a range, results can only be sorted by " + prop)
+            if prop in equality:
+                raise BadQuery("Use either = or a range on " + prop + ", not both")
+            last = (prop, "desc" if sort and sort.startswith("-") else "asc")
+        elif sort is not None:
+            last = (sort.lstrip("-"), "desc" if sort.startswith("-") else "asc")
+        else:
+            last = None
+        props = [(prop, "asc") for prop in equality if last is None or prop != last[0]]
+        if last is not None:
+            props.append(last)
+        return tuple(props)
+
+    # every index a valid query on this endpoint can need
+    def all_indexes(self):
+        indexes = set()
+        equality_props = sorted(p for p, (_, ops) in self.filters.items() if EQUALITY in ops)
+        range_props = sorted(p for p, (_, ops) in self.filters.items() if set(ops) & set(INEQUALITIES))
+        sorts = [None] + [s for prop in self.sorts for s in (prop, "-" + prop)]
+        for count in range(len(equality_props) + 1):
+            for equal in itertools.combinations(equality_props, count):
+                for ranged in [None] + range_props:
+                    for sort in sorts:
+                        filters = [[p, EQUALITY, None] for p in equal]
+                        if ranged is not None:
+                            filters.append([ranged, ">=", None])
+                        try:
+                            props = self.index({"filters": filters, "sort": sort})
+                        except BadQuery:
+                            continue
+                        if props:
+                            indexes.add(props)
+        # projections always come back in sorted property order
+        for count in range(1, len(self.projectable) + 1):
+            for props in itertools.combinations(sorted(self.projectable), count):
+                indexes.add(tuple((prop, "asc") for prop in props))
+        return sorted(indexes)
+
+
+def split_arg(name):
+    if name.endswith("]") and "[" in name:
+        prop, op = name[:-1].split("[", 1)
+        if op not in BRACKET_OPS:
+            raise BadQuery("Unknown operator: " + op)
+        return prop, BRACKET_OPS[op]
+    # date>=x arrives as "date>" = "x" once the query string is split on "="
+    if name.endswith(">"):
+        return name[:-1], ">="
+    if name.endswith("<"):
+        return name[:-1], "<="
+    return name, EQUALITY
+
+
+def apply(query, params):
+    for prop, op, value in params["filters"]:
+        query.add_filter(prop, op, value)
+    if params.get("sort"):
+        query.order = [params["sort"]]
+    if params.get("projection"):
+        query.projection = params["projection"]
+    return query
+
+
+# the asked for properties of an entity (with its id and self already set)
+def select(entity, fields):
+    if fields is None:
+        return entity
+    return dict((f, entity[f]) for f in fields if f in entity)
+
+
+# what GET /orders and GET /items (and their detail routes, for fields) accept
+ORDERS = ListSpec(
+    "orders",
+    filters={"has_shipped": ("bool", (EQUALITY,)),
+             "location": ("str", (EQUALITY,)),
+             "date": ("str", (EQUALITY,) + INEQUALITIES)},
+    sorts=("date",),
+    fields=("has_shipped", "date", "location", "owner_id", "items"),
+    projectable=("has_shipped", "date", "location"))
+ITEMS = ListSpec(
+    "items",
+    filters={"item_name": ("str", (EQUALITY,)),
+             "quantity": ("int", (EQUALITY,) + INEQUALITIES)},
+    sorts=("item_name", "quantity"),
+    fields=("item_name", "quantity", "item_description", "owner_id", "orders"),
+    projectable=("item_name", "quantity"))
+SPECS = (ORDERS, ITEMS)
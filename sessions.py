@@ -0,0 +1,180 @@
+import datetime
+import json
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from google.cloud import datastore
+
+# server-side flask sessions: the cookie only carries a random session id and
+# the session data lives in a store. the data is loaded the first time a view
+# touches the session, so routes that never read it never hit the store.
+
+SID_RE = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+
+class ServerSideSession(SessionMixin):
+    def __init__(self, store, sid=None):
+        self.store = store
+        self.sid = sid
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.replaced_sid = None
+        self._data = None
+
+    def _load(self):
+        self.accessed = True
+        if self._data is None:
+            data = self.store.load(self.sid) if self.sid else None
+            self._data = data if data is not None else {}
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def clear(self):
+        self.accessed = True
+        self._data = {}
+        self.modified = True
+
+    # keep the data under a fresh session id, on login, so an id handed out
+    # before it (or planted in the browser) never becomes an authenticated one
+    def regenerate(self):
+        self._load()
+        if self.sid is not None:
+            self.replaced_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if not sid or not SID_RE.match(sid):
+            sid = None
+        return ServerSideSession(self.store, sid)
+
+    def save_session(self, app, session, response):
+        if not session.modified:
+            return
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.replaced_sid:
+            self.store.delete(session.replaced_sid)
+        if not session._data:
+            if session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        self.store.save(session.sid, dict(session._data), self.ttl)
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+# bounded lru in this process, only right for a single instance or local runs
+class MemorySessionStore(object):
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if time.time() >= expires_at:
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return json.loads(data)
+
+    def save(self, sid, data, ttl):
+        with self._lock:
+            self._sessions[sid] = (json.dumps(data), time.time() + ttl)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+# one SESSIONS entity per session, keyed by the session id
+class DatastoreSessionStore(object):
+    def __init__(self, client, kind='SESSIONS'):
+        self.client = client
+        self.kind = kind
+
+    def load(self, sid):
+        entity = self.client.get(self.client.key(self.kind, sid))
+        if entity is None:
+            return None
+        if entity["expires"] <= datetime.datetime.now(datetime.timezone.utc):
+            self.client.delete(entity.key)
+            return None
+        return json.loads(entity["data"])
+
+    def save(self, sid, data, ttl):
+        entity = datastore.entity.Entity(key=self.client.key(self.kind, sid),
+                                         exclude_from_indexes=("data",))
+        entity.update({"data": json.dumps(data),
+                       "expires": datetime.datetime.now(datetime.timezone.utc)
+                       + datetime.timedelta(seconds=ttl)})
+        self.client.put(entity)
+
+    def delete(self, sid):
+        self.client.delete(self.client.key(self.kind, sid))
+
+    # delete every session that has expired, batch_size keys at a time. load only
+    # drops the ones that come back, this catches the rest (see cleanup_sessions.py)
+    def delete_expired(self, batch_size=500):
+        query = self.client.query(kind=self.kind)
+        query.add_filter("expires", "<=", datetime.datetime.now(datetime.timezone.utc))
+        query.keys_only()
+        deleted = 0
+        while True:
+            keys = [entity.key for entity in query.fetch(limit=batch_size)]
+            if not keys:
+                return deleted
+            self.client.delete_multi(keys)
+            deleted += len(keys)
+
+
+def make_session_interface(backend, client, ttl, cache_size):
+    if backend == 'memory':
+        store = MemorySessionStore(cache_size)
+    elif backend == 'datastore':
+        store = DatastoreSessionStore(client)
+    else:
+        raise ValueError("Unknown session backend: " + str(backend))
+    return ServerSideSessionInterface(store, ttl)
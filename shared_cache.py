@@ -0,0 +1,141 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import token_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# cache shared by every worker process on a node, in an mmap'd file.
+#
+# the file holds one slot for the jwks document and a direct-mapped table of
+# verified token payloads. every slot starts with a sequence number: writers
+# (serialized by a file lock) make it odd while they write and even again when
+# they are done, readers never lock, they copy the slot and only trust it if the
+# sequence was even and did not change while they read it.
+
+MAGIC = b'ORDCACHE'
+VERSION = 1
+# magic, version, token slots, token slot size, jwks slot size
+HEADER = struct.Struct('<8sIIII')
+HEADER_SIZE = 64
+# seq, expires_at, fetched_at, length
+JWKS_SLOT = struct.Struct('<Qddl')
+# seq, expires_at, digest, length
+TOKEN_SLOT = struct.Struct('<Qd32sl')
+
+
+class SharedCache(object):
+    def __init__(self, path, token_slots, token_slot_size, jwks_slot_size):
+        if fcntl is None:
+            raise RuntimeError("The shared cache needs fcntl file locks")
+        self.path = path
+        self.token_slots = token_slots
+        self.token_slot_size = token_slot_size
+        self.jwks_slot_size = jwks_slot_size
+        self.size = HEADER_SIZE + jwks_slot_size + token_slots * token_slot_size
+        self._thread_lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._write_lock():
+            self._init_file()
+        self._mm = mmap.mmap(self._fd, self.size)
+
+    def _write_lock(self):
+        return _FileLock(self._fd, self._thread_lock)
+
+    # lay the file out on first use, or again if another layout was left behind
+    def _init_file(self):
+        header = HEADER.pack(MAGIC, VERSION, self.token_slots,
+                             self.token_slot_size, self.jwks_slot_size)
+        if os.fstat(self._fd).st_size == self.size:
+            current = os.pread(self._fd, HEADER.size, 0)
+            if current == header:
+                return
+        os.ftruncate(self._fd, 0)
+        os.ftruncate(self._fd, self.size)
+        os.pwrite(self._fd, header, 0)
+
+    # returns (jwks, fetched_at, expires_at) or None
+    def load_jwks(self):
+        data = self._read_slot(HEADER_SIZE, JWKS_SLOT)
+        if data is None:
+            return None
+        (_, expires_at, fetched_at, _), body = data
+        if not body:
+            return None
+        return json.loads(body.decode('utf-8')), fetched_at, expires_at
+
+    def store_jwks(self, jwks, fetched_at, expires_at):
+        body = json.dumps(jwks).encode('utf-8')
+        if JWKS_SLOT.size + len(body) > self.jwks_slot_size:
+            return
+        self._write_slot(HEADER_SIZE, JWKS_SLOT, (expires_at, fetched_at, len(body)), body)
+
+    def get_token(self, token):
+        digest = token_cache.token_digest(token)
+        data = self._read_slot(self._token_offset(digest), TOKEN_SLOT)
+        if data is None:
+            return None
+        (_, expires_at, slot_digest, _), body = data
+        if slot_digest != digest or time.time() >= expires_at:
+            return None
+        return json.loads(body.decode('utf-8'))
+
+    def put_token(self, token, payload):
+        expires_at = payload.get("exp")
+        if not expires_at:
+            return
+        body = json.dumps(payload).encode('utf-8')
+        if TOKEN_SLOT.size + len(body) > self.token_slot_size:
+            return
+        digest = token_cache.token_digest(token)
+        self._write_slot(self._token_offset(digest), TOKEN_SLOT,
+                         (expires_at, digest, len(body)), body)
+
+    def _token_offset(self, digest):
+        index = struct.unpack_from('<Q', digest)[0] % self.token_slots
+        return HEADER_SIZE + self.jwks_slot_size + index * self.token_slot_size
+
+    # lock-free read, None when the slot is empty or being written
+    def _read_slot(self, offset, layout):
+        fields = layout.unpack_from(self._mm, offset)
+        seq, length = fields[0], fields[-1]
+        if seq == 0 or seq % 2:
+            return None
+        start = offset + layout.size
+        body = self._mm[start:start + length]
+        if layout.unpack_from(self._mm, offset)[0] != seq:
+            return None
+        return fields, body
+
+    def _write_slot(self, offset, layout, fields, body):
+        with self._write_lock():
+            seq = layout.unpack_from(self._mm, offset)[0]
+            # odd while the slot is being written
+            struct.pack_into('<Q', self._mm, offset, seq + 1)
+            layout.pack_into(self._mm, offset, seq + 1, *fields)
+            start = offset + layout.size
+            self._mm[start:start + len(body)] = body
+            struct.pack_into('<Q', self._mm, offset, seq + 2)
+
+
+# serializes writers across threads (thread lock) and processes (flock)
+class _FileLock(object):
+    def __init__(self, fd, thread_lock):
+        self.fd = fd
+        self.thread_lock = thread_lock
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+        return False
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+# key the caches by a digest so raw bearer tokens are never held as dict keys
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+# bounded, thread-safe lru of token digest -> value, every entry with its own expiry
+class TokenCache(object):
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        digest = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return value
+
+    def set(self, token, value, expires_at):
+        if not expires_at or self.maxsize <= 0:
+            return
+        digest = token_digest(token)
+        with self._lock:
+            self._entries[digest] = (value, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses}
+
+
+# payloads that already passed verification.
+# an entry is only good until the exp claim of its token, after that the
+# token goes through the full verification again (and fails as expired).
+class VerifiedTokenCache(TokenCache):
+    def put(self, token, payload):
+        self.set(token, payload, payload.get("exp"))
+
+
+# tokens that were rejected, with the error they were rejected with.
+# kept for a short ttl so a client retrying the same bad token gets the
+# same answer without another jwks lookup or signature check.
+class RejectedTokenCache(TokenCache):
+    def __init__(self, maxsize, ttl):
+        super(RejectedTokenCache, self).__init__(maxsize)
+        self.ttl = ttl
+
+    def put(self, token, error):
+        self.set(token, error, time.time() + self.ttl)
+
+
+# counts auth failures per client in a fixed window. once a client reaches
+# max_failures it is throttled until its window runs out.
+class FailureThrottle(object):
+    def __init__(self, max_failures, window, maxsize=10000):
+        self.max_failures = max_failures
+        self.window = window
+        self.maxsize = maxsize
+        self.throttled = 0
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    # seconds until the client may try again, 0 when it is not throttled
+    def retry_after(self, client):
+        now = time.time()
+        with self._lock:
+            entry = self._clients.get(client)
+            if entry is None:
+                return 0
+            window_start, failures = entry
+            if now - window_start >= self.window:
+                del self._clients[client]
+                return 0
+            if failures < self.max_failures:
+                return 0
+            self.throttled += 1
+            return int(window_start + self.window - now) + 1
+
+    def record_failure(self, client):
+        now = time.time()
+        with self._lock:
+            entry = self._clients.get(client)
+            if entry is None or now - entry[0] >= self.window:
+                entry = (now, 0)
+            self._clients[client] = (entry[0], entry[1] + 1)
+            self._clients.move_to_end(client)
+            while len(self._clients) > self.maxsize:
+                self._clients.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._clients), "throttled": self.throttled}
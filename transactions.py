@@ -0,0 +1,23 @@
+import random
+import time
+from google.api_core import exceptions
+import constants
+
+
+# run func inside a datastore transaction and return what it returns.
+# when the commit loses to a concurrent transaction on the same entities the
+# whole function runs again (it has to re-read what it writes), after a short
+# randomized backoff that doubles each time up to max_delay, up to max_attempts
+# tries. after that the Conflict is raised (a 409 from the api).
+def run_in_transaction(client, func, max_attempts=constants.TXN_MAX_ATTEMPTS,
+                       base_delay=constants.TXN_BASE_DELAY, max_delay=constants.TXN_MAX_DELAY):
+    attempt = 1
+    while True:
+        try:
+            with client.transaction():
+                return func()
+        except exceptions.Conflict:
+            if attempt >= max_attempts:
+                raise
+        time.sleep(random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1)))))
+        attempt += 1
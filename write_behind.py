@@ -0,0 +1,101 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# bounded queue of entities nobody reads back in the request that writes them
+# (user bookkeeping and the like). a background thread drains it into put_multi
+# batches of up to batch_size, waiting at most flush_interval seconds to fill one.
+# when the queue is full the write is done inline instead of being dropped, and
+# whatever is still queued is flushed when the process exits.
+class WriteBehindQueue(object):
+    def __init__(self, client, maxsize, batch_size, flush_interval):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self.failed = 0
+        self.inline = 0
+        self.batches = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = 0
+        self._queue = queue.Queue(maxsize)
+        self._stats_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, entity):
+        if not self._stopped.is_set():
+            try:
+                self._queue.put_nowait(entity)
+                return
+            except queue.Full:
+                pass
+        with self._stats_lock:
+            self.inline += 1
+        self.client.put(entity)
+
+    # stop the worker and write out everything still queued
+    def close(self, timeout=10):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopped.is_set():
+                return
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if self._stopped.is_set():
+                remaining = 0
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        # the last write to a key wins, and a batch can't name a key twice
+        entities = {}
+        for entity in batch:
+            entities[entity.key.flat_path if not entity.key.is_partial else id(entity)] = entity
+        started = time.perf_counter()
+        try:
+            self.client.put_multi(list(entities.values()))
+            failed = 0
+        except Exception:
+            logger.exception("Write-behind flush of %d entities failed", len(entities))
+            failed = len(entities)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self.batches += 1
+            self.flushed += len(entities) - failed
+            self.failed += failed
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+    def stats(self):
+        with self._stats_lock:
+            return {"depth": self._queue.qsize(), "flushed": self.flushed,
+                    "failed": self.failed, "inline": self.inline,
+                    "batches": self.batches,
+                    "last_flush_ms": None if self.last_flush_ms is None else round(self.last_flush_ms, 2),
+                    "max_flush_ms": round(self.max_flush_ms, 2)}